@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+答案缓存
+调用DeepSeek生成答案需要数秒且按量计费。问题与检索到的文档块都相同时，直接返回此前生成的答案。
+答案以SQLite持久化保存在 cache/ 目录，键覆盖规范化后的问题、文档块标识与内容哈希、模型、提示词版本与温度；
+按总大小与最后访问时间淘汰，多个进程（及同一进程的多个线程）可同时读写
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional
+
+from token_cache import text_digest
+
+
+def context_digest(chunks: Iterable[Mapping]) -> str:
+    """检索到的文档块的哈希：按顺序覆盖来源文件、文档块编号与内容哈希
+
+    内容哈希使文档修改后（文档块编号不变而内容变化）旧答案不会被误用。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        h.update(json.dumps([chunk['source'], chunk['chunk_id']], ensure_ascii=False).encode('utf-8'))
+        h.update(text_digest(chunk['content']))
+    return h.hexdigest()
+
+
+def answer_key(question: str, context: str, model: str, prompt_version: int, temperature: float) -> bytes:
+    """答案缓存的键
+
+    Args:
+        question: 规范化后的问题
+        context: context_digest 得到的文档块哈希
+        model: 模型名称
+        prompt_version: 提示词版本
+        temperature: 采样温度
+    """
+    payload = json.dumps([question, context, model, prompt_version, temperature], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+
+class AnswerCache:
+    """持久化答案缓存
+
+    写入时先删除超过 max_age 未被访问的条目，总大小超过 max_bytes 时再按最后访问时间从旧到新删除。
+    每个线程使用独立的连接，fork出的子进程会重新连接；写入使用 BEGIN IMMEDIATE 事务，
+    多个进程同时写入时由SQLite加锁串行化（WAL模式下读取不受写入阻塞）。
+    hits/misses 记录本实例的命中与未命中次数。
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int = 64 * 1024 * 1024, max_age: Optional[float] = 30 * 86400):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            max_bytes: 缓存答案的总大小上限（按问题与答案的UTF-8字节数计）
+            max_age: 条目最长未被访问的时间（秒），None为不按时间淘汰
+        """
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key BLOB PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: bytes) -> Optional[str]:
+        """查询缓存的答案，未命中（或已超过 max_age）时返回None"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT answer, accessed FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                row = None
+            if row is not None:
+                conn.execute("UPDATE answers SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"读取答案缓存时出错: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: bytes, question: str, answer: str, model: str) -> None:
+        """写入答案（已存在时覆盖），并按时间与大小淘汰旧条目"""
+        now = time.time()
+        size = len(question.encode('utf-8')) + len(answer.encode('utf-8'))
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR REPLACE INTO answers (key, question, answer, model, size, created, accessed) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, question, answer, model, size, now, now))
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"写入答案缓存时出错: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.max_age is not None:
+            conn.execute("DELETE FROM answers WHERE accessed < ?", (now - self.max_age,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 按最后访问时间从旧到新累计，删除超出部分
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM answers ORDER BY accessed"):
+            if total - freed <= self.max_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM answers WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计：命中数、未命中数、命中率，以及数据库中的条目数与总大小"""
+        total = self.hits + self.misses
+        try:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+BM25检索引擎
+由全量词频矩阵（与TF-IDF相同的jieba分词与N-gram）预先计算每个文档块中每个词项的BM25权重，
+文档长度归一化与IDF均已计入权重，查询时只需一次稀疏矩阵乘法（或倒排检索）
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+import scipy.sparse as sp
+
+from index_store import StringTable
+from inverted_index import InvertedIndex, write_postings
+from term_counts import csr_from_arrays, csr_rows, row_blocks
+
+# BM25参数的默认值
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+
+def bm25_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """BM25的IDF（加1平滑，保证非负）：ln(1 + (N - df + 0.5) / (df + 0.5))"""
+    return np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+
+class BM25Index:
+    """BM25索引
+
+    文档块×词项的权重矩阵 w(d, t) = idf(t) · tf·(k1+1) / (tf + k1·(1 - b + b·|d|/avgdl))，
+    文档块得分为查询中各词项出现次数与权重之积的和。词项按字典序存储，查询时二分查找列号，
+    加载时无需构建词表字典。
+    """
+
+    def __init__(self, terms: StringTable, doc_weights: sp.csr_matrix, inverted_index: InvertedIndex):
+        self.terms = terms
+        self.doc_weights = doc_weights
+        self.inverted_index = inverted_index
+
+    @staticmethod
+    def write(writer, counts: sp.csr_matrix, terms: List[str], df: np.ndarray, tf: np.ndarray,
+              k1: float = DEFAULT_K1, b: float = DEFAULT_B, max_nnz: int = 1 << 22) -> Dict:
+        """由词频矩阵分块计算BM25权重，连同倒排表写入索引目录
+
+        Args:
+            writer: index_store.StoreWriter
+            counts: 文档块×词项的词频矩阵（可由内存映射数组构建）
+            terms: 词项列表
+            df: 各词项的文档频率
+            tf: 各词项的总词频
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+            max_nnz: 每块最多处理的非零元数
+
+        Returns:
+            需要写入manifest的信息
+        """
+        n_docs, n_terms = counts.shape
+        # 词项按字典序重新编号
+        order = np.array(sorted(range(n_terms), key=terms.__getitem__), dtype=np.int64)
+        rank = np.empty(n_terms, dtype=np.int32)
+        rank[order] = np.arange(n_terms, dtype=np.int32)
+        idf = bm25_idf(df, n_docs)
+        avgdl = max(float(np.sum(tf)) / max(n_docs, 1), 1e-9)
+
+        writer.append('bm25_indptr', [0], dtype=np.int32 if counts.nnz <= np.iinfo(np.int32).max else np.int64)
+        writer.append('bm25_data', np.empty(0, dtype=np.float32))
+        writer.append('bm25_indices', np.empty(0, dtype=np.int32))
+        nnz = 0
+        for start, end in row_blocks(counts.indptr, max_nnz):
+            block = csr_rows(counts, start, end)
+            freqs = block.data.astype(np.float64)
+            lengths = np.asarray(block.sum(axis=1), dtype=np.float64).ravel()
+            norms = np.repeat(k1 * (1 - b + b * lengths / avgdl), np.diff(block.indptr))
+            weights = sp.csr_matrix(
+                (idf[block.indices] * freqs * (k1 + 1) / (freqs + norms), rank[block.indices], block.indptr),
+                shape=block.shape
+            )
+            weights.sort_indices()
+            writer.append('bm25_data', weights.data.astype(np.float32))
+            writer.append('bm25_indices', weights.indices)
+            writer.append('bm25_indptr', weights.indptr[1:] + nnz)
+            nnz += weights.nnz
+
+        doc_weights = csr_from_arrays(writer.appended('bm25_data'), writer.appended('bm25_indices'),
+                                      writer.appended('bm25_indptr'), (n_docs, n_terms))
+        write_postings(writer, doc_weights, max_nnz)
+        del doc_weights
+
+        term_table = StringTable.from_strings(terms[i] for i in order)
+        writer.save('term_blob', term_table.blob)
+        writer.save('term_offsets', term_table.offsets)
+        return {'shape': [n_docs, n_terms], 'nnz': nnz, 'k1': k1, 'b': b, 'avgdl': avgdl}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], manifest: Dict) -> "BM25Index":
+        """由 read_store 读出的数组（内存映射）构建"""
+        shape = tuple(manifest['shape'])
+        doc_weights = csr_from_arrays(arrays['bm25_data'], arrays['bm25_indices'], arrays['bm25_indptr'], shape)
+        return cls(StringTable(arrays['term_blob'], arrays['term_offsets']), doc_weights,
+                   InvertedIndex.from_arrays(arrays, n_docs=shape[0]))
+
+    def term_id(self, term: str) -> int:
+        """词项的列号，不在词表中时返回-1"""
+        i = bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else -1
+
+    def query_vector(self, features: List[str]) -> sp.csr_matrix:
+        """由查询的特征（分词及N-gram）构建1×词项的稀疏查询向量，值为各词项在查询中的出现次数"""
+        weights = {}
+        for term, count in Counter(features).items():
+            term_id = self.term_id(term)
+            if term_id >= 0:
+                weights[term_id] = float(count)
+        ids = np.array(sorted(weights), dtype=np.int32)
+        data = np.array([weights[i] for i in ids], dtype=np.float32)
+        return sp.csr_matrix((data, ids, np.array([0, len(ids)], dtype=np.int32)),
+                             shape=(1, self.doc_weights.shape[1]))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+文档分块
+一次正则扫描得到全部句子的边界，再按句子贪心组块；相邻文档块之间按句子重叠。
+文档块以原文中的 (起始, 结束) 区间表示，需要时才切出字符串
+"""
+
+import re
+from typing import List, Tuple
+
+# 句子：以非空白、非句末标点开头，直到句末标点（可连续，如"！？"）及其后的右引号/右括号为止；
+# 句间的空白与多余标点不属于任何句子
+SENTENCE_PATTERN = re.compile(r'[^\s。！？][^。！？]*(?:[。！？]+[”’"」』）]*)?')
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """返回全部句子在原文中的 (起始, 结束) 字符位置，去除句尾空白"""
+    spans = []
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        if text[end - 1].isspace():
+            end = start + len(match.group().rstrip())
+        spans.append((start, end))
+    return spans
+
+
+def chunk_spans(text: str, chunk_size: int = 300, overlap: int = 50) -> List[Tuple[int, int]]:
+    """将文本按句子分块
+
+    依次加入句子，直到文档块长度超过chunk_size（单个句子超长时独占一块）；
+    下一个文档块从上一块末尾总长不超过overlap的若干句子开始，且至少包含一个新句子。
+    总耗时与文本长度成线性关系。
+
+    Args:
+        text: 文档全文
+        chunk_size: 文档块最大字符数
+        overlap: 相邻文档块重叠的最大字符数（按整句计）
+
+    Returns:
+        各文档块在原文中的 (起始, 结束) 字符位置
+    """
+    sentences = sentence_spans(text)
+    chunks = []
+    i = 0
+    while i < len(sentences):
+        start = sentences[i][0]
+        j = i + 1
+        while j < len(sentences) and sentences[j][1] - start <= chunk_size:
+            j += 1
+        end = sentences[j - 1][1]
+        chunks.append((start, end))
+        if j == len(sentences):
+            break
+        # 从本块末尾向前取重叠句子；加上下一句会超过chunk_size时减少重叠，保证每块都有新句子
+        k = j
+        while k - 1 > i and end - sentences[k - 1][0] <= overlap:
+            k -= 1
+        while k < j and sentences[j][1] - sentences[k][0] > chunk_size:
+            k += 1
+        i = k
+    return chunks
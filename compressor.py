@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+抽取式上下文压缩
+300字的文档块中通常只有一两句与问题直接相关。这里将放入提示词的文档片段按句切分（与分块使用同一套
+句子边界），所有句子一次向量化、与查询向量做一次稀疏矩阵乘法得到得分，按得分从高到低保留句子及其
+相邻句子，直到达到压缩比例；同一片段中不连续的句子之间以省略号连接
+"""
+
+import threading
+from typing import Callable, Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from chunker import sentence_spans
+from context_packer import estimate_tokens
+
+# 同一片段中被省略的句子以此连接
+ELLIPSIS = "……"
+
+
+class ContextCompressor:
+    """抽取式压缩文档片段（统计线程安全）
+
+    只有与查询有共同词项（得分大于0）的句子会被选作中心句；没有任何句子得分大于0时
+    （如稠密检索找到的语义相关片段）无法判断哪些句子重要，片段原样保留。
+    片段中没有句子被保留时整段去除。
+
+    统计项：requests 为压缩次数，tokens_before/tokens_after 为压缩前后的估算token数之和，
+    sentences_before/sentences_after 为压缩前后的句子数之和。
+    """
+
+    def __init__(self, ratio: float = 0.5, neighbours: int = 1):
+        """
+        Args:
+            ratio: 压缩后最多保留的字符比例（0~1）
+            neighbours: 每个中心句前后一并保留的句子数
+        """
+        if not 0.0 < ratio <= 1.0:
+            raise ValueError(f"压缩比例应在(0, 1]之间: {ratio}")
+        self.ratio = ratio
+        self.neighbours = neighbours
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.sentences_before = 0
+        self.sentences_after = 0
+        self._lock = threading.Lock()
+
+    def compress(self, query_vector: sp.csr_matrix, chunks: Sequence[Mapping],
+                 vectorize: Callable[[List[str]], sp.csr_matrix]) -> Tuple[List[Dict], Dict[str, int]]:
+        """压缩文档片段
+
+        Args:
+            query_vector: 1×词项的L2归一化TF-IDF查询向量
+            chunks: 放入提示词的文档片段（按重要性排列）
+            vectorize: 将句子列表转换为与 query_vector 同一空间的TF-IDF矩阵的函数
+
+        Returns:
+            (压缩后的片段（顺序不变，内容为保留的句子）, 本次压缩的统计：压缩前后的句子数
+             sentences_before/sentences_after、估算token数 tokens_before/tokens_after 与减少的token数 tokens_saved)
+        """
+        contents = [chunk['content'] for chunk in chunks]
+        spans = [sentence_spans(content) for content in contents]
+        # 各句子所属的片段
+        owners = np.repeat(np.arange(len(chunks)), [len(s) for s in spans])
+        sentences = [content[start:end] for content, chunk_spans in zip(contents, spans) for start, end in chunk_spans]
+        lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+
+        scores = np.zeros(len(sentences))
+        if sentences and query_vector.nnz:
+            scores = (vectorize(sentences) @ query_vector.T).toarray().ravel()
+        keep = self._select(scores, lengths, owners)
+
+        compressed = []
+        for i, chunk in enumerate(chunks):
+            mask = keep[owners == i]
+            if not mask.any():
+                continue
+            if mask.all():
+                compressed.append(dict(chunk))
+                continue
+            compressed.append(dict(chunk, content=self._join(contents[i], spans[i], mask)))
+
+        tokens_before = sum(estimate_tokens(content) for content in contents)
+        tokens_after = sum(estimate_tokens(chunk['content']) for chunk in compressed)
+        report = {
+            'sentences_before': len(sentences),
+            'sentences_after': int(keep.sum()),
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': tokens_before - tokens_after,
+        }
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+            self.sentences_before += report['sentences_before']
+            self.sentences_after += report['sentences_after']
+        return compressed, report
+
+    def _select(self, scores: np.ndarray, lengths: np.ndarray, owners: np.ndarray) -> np.ndarray:
+        """按得分从高到低选择中心句及其相邻句子，返回各句子是否保留"""
+        n = len(scores)
+        if not np.any(scores > 0):
+            return np.ones(n, dtype=bool)
+        keep = np.zeros(n, dtype=bool)
+        budget = self.ratio * lengths.sum()
+        used = 0
+        # 得分相同时按片段与句子的先后
+        for seed in np.argsort(-scores, kind='stable'):
+            if scores[seed] <= 0:
+                break
+            if keep[seed]:
+                continue
+            low, high = max(0, seed - self.neighbours), min(n, seed + self.neighbours + 1)
+            window = np.arange(low, high)
+            window = window[(owners[window] == owners[seed]) & ~keep[window]]
+            cost = lengths[window].sum()
+            if used + cost > budget and used > 0:
+                # 连同相邻句子放不下时只保留中心句
+                window = np.array([seed])
+                cost = lengths[seed]
+                if used + cost > budget:
+                    continue
+            keep[window] = True
+            used += cost
+        return keep
+
+    @staticmethod
+    def _join(content: str, spans: List[Tuple[int, int]], mask: np.ndarray) -> str:
+        """将保留的句子按原文顺序拼接：连续的句子保留原文（含句间空白），不连续处以省略号连接"""
+        parts = []
+        i = 0
+        while i < len(spans):
+            if not mask[i]:
+                i += 1
+                continue
+            j = i
+            while j + 1 < len(spans) and mask[j + 1]:
+                j += 1
+            parts.append(content[spans[i][0]:spans[j][1]])
+            i = j + 1
+        return ELLIPSIS.join(parts)
+
+    def stats(self) -> Dict[str, float]:
+        """累计统计：压缩次数、压缩前后的估算token数与句子数、减少的token数与比例"""
+        return {
+            'requests': self.requests,
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_before - self.tokens_after,
+            'saved_ratio': 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+            'sentences_before': self.sentences_before,
+            'sentences_after': self.sentences_after,
+        }
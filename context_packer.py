@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+上下文打包
+检索得到的 top_k 个文档块不加筛选地全部放入提示词，会带入大量重复文字：同一章回的相邻文档块按句子重叠，
+书中的套语也常使几个文档块几乎相同。这里在检索与生成答案之间：
+合并同一章回中重叠或相邻的文档块（按原文区间合并，重叠部分只出现一次），去除近似重复的片段，
+再按边际相关度贪心地填满token预算，并估算节省的token数
+"""
+
+import math
+import threading
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from index_store import ChunkView
+
+# DeepSeek的计费说明：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKENS_PER_CHAR = 0.6
+ASCII_TOKENS_PER_CHAR = 0.3
+# 每个文档片段在提示词中的额外开销（"文档片段N："与分隔的空行）
+SEGMENT_OVERHEAD_TOKENS = 6
+# 判断重复时使用的字符n-gram长度
+SHINGLE_SIZE = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符类别估算文本的token数（无需下载分词器，与DeepSeek的实际计数相差不大）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil((len(text) - ascii_chars) * CJK_TOKENS_PER_CHAR + ascii_chars * ASCII_TOKENS_PER_CHAR)
+
+
+def _shingles(text: str) -> frozenset:
+    """文本的字符n-gram集合（忽略空白）"""
+    text = "".join(text.split())
+    if len(text) <= SHINGLE_SIZE:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1))
+
+
+def merge_adjacent(chunks: Sequence[Mapping]) -> List[Dict]:
+    """合并同一来源中原文区间重叠或相邻（块编号连续）的文档块
+
+    只有检索结果（ChunkView）带有原文区间，合并后的内容为原文中的连续一段，重叠部分只出现一次；
+    其他文档块原样保留。合并后的片段以首个文档块的编号为 chunk_id，相似度取各文档块的最大值，
+    chunk_ids 为所含的全部文档块编号。
+
+    Returns:
+        片段列表，顺序与各片段中最相关的文档块在输入中的顺序一致
+    """
+    groups = {}
+    segments = []
+    for rank, chunk in enumerate(chunks):
+        if isinstance(chunk, ChunkView):
+            table = chunk.table
+            key = (id(table), int(table.source_ids[chunk.index]))
+            groups.setdefault(key, []).append((rank, chunk))
+        else:
+            segments.append((rank, {
+                'content': chunk['content'],
+                'source': chunk['source'],
+                'chunk_id': chunk['chunk_id'],
+                'full_path': chunk.get('full_path', ''),
+                'similarity': chunk.get('similarity') or 0.0,
+                'chunk_ids': (chunk['chunk_id'],),
+            }))
+
+    for members in groups.values():
+        texts = members[0][1].table.texts
+        members.sort(key=lambda item: int(texts.starts[item[1].index]))
+        run = [members[0]]
+        for item in members[1:]:
+            previous, chunk = run[-1][1], item[1]
+            end = max(int(texts.ends[c.index]) for _, c in run)
+            if int(texts.starts[chunk.index]) <= end or chunk.chunk_id == previous.chunk_id + 1:
+                run.append(item)
+            else:
+                segments.append(_merge_run(run))
+                run = [item]
+        segments.append(_merge_run(run))
+
+    segments.sort(key=lambda item: item[0])
+    return [segment for _, segment in segments]
+
+
+def _merge_run(run: List[Tuple[int, ChunkView]]) -> Tuple[int, Dict]:
+    """将一组按原文位置排列的文档块合并为一个片段，返回 (最靠前的名次, 片段)"""
+    first = run[0][1]
+    if len(run) == 1:
+        content = first.content
+    else:
+        texts = first.table.texts
+        start = int(texts.starts[first.index])
+        end = max(int(texts.ends[chunk.index]) for _, chunk in run)
+        content = texts.blob[start:end].tobytes().decode('utf-8')
+    return min(rank for rank, _ in run), {
+        'content': content,
+        'source': first.source,
+        'chunk_id': first.chunk_id,
+        'full_path': first.full_path,
+        'similarity': max((chunk.similarity or 0.0) for _, chunk in run),
+        'chunk_ids': tuple(chunk.chunk_id for _, chunk in run),
+    }
+
+
+class ContextPacker:
+    """在token预算内选择放入提示词的文档片段（统计线程安全）
+
+    合并相邻文档块后，每轮选择边际相关度最高且放得下的片段：边际相关度为片段的相似度乘以
+    其尚未被已选片段覆盖的字符n-gram比例；覆盖比例达到 duplicate_threshold 的片段视为重复，直接去除。
+    最相关的片段单独就超出预算时截断该片段，保证至少有一段上下文。
+
+    统计项：requests 为打包次数，tokens_before/tokens_after 为打包前后的估算token数之和，
+    tokens_saved 为两者之差，merged 与 duplicates 为被合并的文档块数与去除的重复片段数。
+    """
+
+    def __init__(self, token_budget: int = 1200, duplicate_threshold: float = 0.8):
+        """
+        Args:
+            token_budget: 文档片段的token预算（估算值，不含系统提示词与问题）
+            duplicate_threshold: 片段的字符n-gram被已选片段覆盖的比例达到此值时视为重复
+        """
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.merged = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def pack(self, chunks: Sequence[Mapping]) -> Tuple[List[Dict], Dict[str, int]]:
+        """打包文档块
+
+        Args:
+            chunks: 检索到的文档块，按相似度从高到低排列
+
+        Returns:
+            (选中的片段（按边际相关度选择的先后排列）, 本次打包的统计：文档块数 chunks、片段数 segments、
+             合并的文档块数 merged、重复片段数 duplicates、超出预算未选的片段数 dropped、
+             打包前后的估算token数 tokens_before/tokens_after 与节省的token数 tokens_saved)
+        """
+        tokens_before = sum(estimate_tokens(chunk['content']) + SEGMENT_OVERHEAD_TOKENS for chunk in chunks)
+        segments = merge_adjacent(chunks)
+        candidates = [(segment, _shingles(segment['content']),
+                       estimate_tokens(segment['content']) + SEGMENT_OVERHEAD_TOKENS) for segment in segments]
+
+        selected = []
+        covered = set()
+        remaining = self.token_budget
+        duplicates = 0
+        while candidates:
+            best, best_gain = None, 0.0
+            for i, (segment, shingles, tokens) in enumerate(candidates):
+                redundancy = len(shingles & covered) / len(shingles) if shingles else 1.0
+                if redundancy >= self.duplicate_threshold:
+                    best, best_gain = i, None
+                    break
+                gain = segment['similarity'] * (1.0 - redundancy)
+                if tokens <= remaining and (best is None or gain > best_gain):
+                    best, best_gain = i, gain
+            if best is None:
+                break
+            segment, shingles, tokens = candidates.pop(best)
+            if best_gain is None:
+                duplicates += 1
+                continue
+            selected.append(segment)
+            covered |= shingles
+            remaining -= tokens
+
+        if not selected and candidates:
+            selected.append(self._truncate(candidates.pop(0)[0]))
+
+        tokens_after = sum(estimate_tokens(segment['content']) + SEGMENT_OVERHEAD_TOKENS for segment in selected)
+        report = {
+            'chunks': len(chunks),
+            'segments': len(selected),
+            'merged': len(chunks) - len(segments),
+            'duplicates': duplicates,
+            'dropped': len(candidates),
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': tokens_before - tokens_after,
+        }
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+            self.merged += report['merged']
+            self.duplicates += duplicates
+        return selected, report
+
+    def _truncate(self, segment: Dict) -> Dict:
+        """将片段截断到token预算以内"""
+        limit = max(0, self.token_budget - SEGMENT_OVERHEAD_TOKENS)
+        content = segment['content']
+        end = min(len(content), int(limit / ASCII_TOKENS_PER_CHAR))
+        while end > 0 and estimate_tokens(content[:end]) > limit:
+            end = int(end * limit / estimate_tokens(content[:end]))
+        return dict(segment, content=content[:end])
+
+    def stats(self) -> Dict[str, float]:
+        """累计统计：打包次数、打包前后的估算token数、节省的token数与比例、合并的文档块数与重复片段数"""
+        return {
+            'requests': self.requests,
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_before - self.tokens_after,
+            'saved_ratio': 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+            'merged': self.merged,
+            'duplicates': self.duplicates,
+        }
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+自适应截断
+相似度阈值（默认0.01）几乎不起过滤作用，问答时总是把 top_k 个文档块全部交给大模型，
+即使只有两三个真正相关。这里根据检索得分曲线的形状决定保留的数量：
+拐点（knee）检测找出得分从陡降转为平缓的位置，相对下降（drop）保留得分不低于最高分一定比例的文档块
+"""
+
+import numpy as np
+
+# 支持的截断方式
+CUTOFF_METHODS = ("knee", "drop")
+# 曲线与首尾连线的距离小于该值时视为直线（没有拐点），避免浮点误差
+KNEE_TOLERANCE = 1e-6
+
+
+def knee_point(scores: np.ndarray) -> int:
+    """得分曲线的拐点位置（Kneedle算法）
+
+    将按从高到低排列的得分曲线的横、纵坐标都归一化到[0, 1]，拐点为曲线位于首尾连线下方最远的点：
+    此前的得分陡降，此后趋于平缓。拐点之前的文档块明显比其余的更相关。
+
+    Args:
+        scores: 按从高到低排列的得分
+
+    Returns:
+        拐点的位置（即应保留的数量）；得分少于3个或曲线没有下凸的拐点时返回得分个数
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    if n < 3 or scores[0] <= scores[-1]:
+        return n
+    x = np.arange(n) / (n - 1)
+    y = (scores - scores[-1]) / (scores[0] - scores[-1])
+    # 首尾连线 y = 1 - x 与曲线的纵向距离
+    distance = (1.0 - x) - y
+    knee = int(np.argmax(distance))
+    return knee if distance[knee] > KNEE_TOLERANCE else n
+
+
+def adaptive_k(scores: np.ndarray, method: str = "knee", min_k: int = 2, max_k: int = None,
+               drop_ratio: float = 0.5) -> int:
+    """根据得分曲线确定保留的文档块数量
+
+    Args:
+        scores: 按从高到低排列的得分
+        method: "knee"为拐点检测，"drop"为保留得分不低于 最高分×drop_ratio 的文档块
+        min_k: 至少保留的数量
+        max_k: 至多保留的数量，默认为得分个数
+        drop_ratio: 相对下降方式的比例
+
+    Returns:
+        保留的数量（不超过得分个数）
+    """
+    if method not in CUTOFF_METHODS:
+        raise ValueError(f"不支持的截断方式: {method}")
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    max_k = n if max_k is None else min(max_k, n)
+    if method == "knee":
+        k = knee_point(scores[:max_k])
+    else:
+        k = int(np.count_nonzero(scores[:max_k] >= scores[0] * drop_ratio)) if n else 0
+    return max(min(k, max_k), min(min_k, max_k))
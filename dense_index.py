@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+稠密检索（LSA）
+对TF-IDF矩阵做截断SVD得到低维文档块向量（float32或int8量化），
+以倒排文件（IVF，球面k-means聚类）做近似最近邻检索；全部在本地用NumPy完成，无需下载模型。
+构建时以文档块向量为查询测量近似检索相对精确检索的Recall@k，自动选择满足目标召回率的最少探查簇数
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.decomposition import TruncatedSVD
+
+from inverted_index import select_top_k
+from term_counts import csr_rows, row_blocks
+
+# 以矩阵乘法分块计算相似度时每块的行数
+_BLOCK_ROWS = 4096
+# IVF的簇数为 IVF_LISTS_PER_SQRT×sqrt(文档块数)：簇越小，达到同样召回率时需要计算的文档块向量越少
+IVF_LISTS_PER_SQRT = 4
+# 聚类时每个簇的样本数
+IVF_SAMPLES_PER_LIST = 50
+# 稠密索引的构建方式版本，修改簇数等构建参数时递增，使已有的稠密索引重建
+DENSE_INDEX_VERSION = 2
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """将每个向量分配到内积最大的簇中心（分块计算，不生成完整的相似度矩阵）"""
+    assign = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), _BLOCK_ROWS):
+        block = np.asarray(x[start:start + _BLOCK_ROWS], dtype=np.float32)
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def spherical_kmeans(x: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """球面k-means：以内积为相似度聚类已归一化的向量
+
+    Returns:
+        (n_clusters, 维数) 的归一化簇中心
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array(x[np.sort(rng.choice(len(x), n_clusters, replace=False))], dtype=np.float32)
+    for _ in range(n_iter):
+        assign = _assign(x, centroids)
+        members = sp.csr_matrix((np.ones(len(x), dtype=np.float32), (assign, np.arange(len(x)))),
+                                shape=(n_clusters, len(x)))
+        sums = np.asarray(members @ x, dtype=np.float32)
+        # 空簇重新随机选取中心
+        empty = np.flatnonzero(np.asarray(members.sum(axis=1)).ravel() == 0)
+        if len(empty):
+            sums[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+class DenseIndex:
+    """LSA稠密向量索引
+
+    文档块向量为TF-IDF向量在前n_components个奇异向量上的投影（按行L2归一化），
+    查询向量以相同方式投影，内积即LSA空间中的余弦相似度。
+    """
+
+    def __init__(self, components: np.ndarray, embeddings: np.ndarray, scales: Optional[np.ndarray],
+                 centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray, nprobe: int):
+        self.components = components
+        # 投影查询时使用的连续存储的转置（词项×维数）
+        self._basis = np.ascontiguousarray(components.T)
+        self.embeddings = embeddings
+        self.scales = scales
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+        # 构建时测得的平均每次查询计算的文档块向量比例，以及回退为精确检索的查询比例
+        self.scan_ratio = 1.0
+        self.exact_ratio = 1.0
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def write(writer, doc_vectors: sp.csr_matrix, n_components: int = 256, dtype: str = "float32",
+              target_recall: float = 0.95, recall_k: int = 10, n_eval_queries: int = 200,
+              max_nnz: int = 1 << 22, seed: int = 0) -> Dict:
+        """构建稠密索引并写入索引目录
+
+        Args:
+            writer: index_store.StoreWriter
+            doc_vectors: 文档块×词项的TF-IDF矩阵（行已L2归一化）
+            n_components: LSA维数
+            dtype: 文档块向量的存储类型，"float32" 或 "int8"（逐行对称量化）
+            target_recall: 近似检索相对精确检索的目标Recall@k
+            recall_k: 测量召回率时的k
+            n_eval_queries: 测量召回率时的查询数
+            max_nnz: 投影时每块最多处理的非零元数
+            seed: 随机种子
+
+        Returns:
+            需要写入manifest的信息，包括选定的探查簇数与各探查簇数下的召回率
+        """
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"不支持的向量类型: {dtype}")
+        n_docs, n_features = doc_vectors.shape
+        n_components = max(1, min(n_components, n_features - 1, n_docs - 1))
+        svd = TruncatedSVD(n_components=n_components, algorithm='randomized', n_iter=5, random_state=seed)
+        svd.fit(doc_vectors)
+        components = svd.components_.astype(np.float32)
+
+        # 分块投影并归一化；int8量化时先写入临时的float32数组
+        if dtype == "float32":
+            vectors = writer.create('embeddings', (n_docs, n_components), np.float32)
+        else:
+            vectors = np.lib.format.open_memmap(writer.tmp_dir / 'vectors.tmp', mode='w+',
+                                                dtype=np.float32, shape=(n_docs, n_components))
+        for start, end in row_blocks(doc_vectors.indptr, max_nnz):
+            block = csr_rows(doc_vectors, start, end)
+            vectors[start:end] = _normalize_rows(np.asarray(block @ components.T, dtype=np.float32))
+
+        # IVF：约 IVF_LISTS_PER_SQRT×sqrt(N) 个簇，簇中心由最多 IVF_SAMPLES_PER_LIST×簇数 个样本聚类得到
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, min(n_docs, int(IVF_LISTS_PER_SQRT * np.sqrt(n_docs))))
+        sample = np.sort(rng.choice(n_docs, min(n_docs, IVF_SAMPLES_PER_LIST * n_lists), replace=False))
+        centroids = spherical_kmeans(vectors[sample], n_lists, seed=seed)
+        assign = _assign(vectors, centroids)
+        list_ids = np.argsort(assign, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=list_offsets[1:])
+
+        embeddings, scales = vectors, None
+        if dtype == "int8":
+            embeddings = writer.create('embeddings', (n_docs, n_components), np.int8)
+            scales = writer.create('scales', n_docs, np.float32)
+            for start in range(0, n_docs, _BLOCK_ROWS):
+                block = vectors[start:start + _BLOCK_ROWS]
+                block_scales = np.abs(block).max(axis=1) / 127.0
+                block_scales[block_scales == 0] = 1.0
+                scales[start:start + len(block)] = block_scales
+                embeddings[start:start + len(block)] = np.round(block / block_scales[:, None])
+            scales.flush()
+            del vectors
+            (writer.tmp_dir / 'vectors.tmp').unlink()
+        embeddings.flush()
+
+        index = DenseIndex(components, embeddings, scales, centroids, list_offsets, list_ids, n_lists)
+        recalls = index.tune_nprobe(target_recall, recall_k, n_eval_queries, seed)
+
+        writer.save('components', components)
+        writer.save('centroids', centroids)
+        writer.save('list_offsets', list_offsets)
+        writer.save('list_ids', list_ids)
+        return {
+            'shape': [n_docs, n_components],
+            'dtype': dtype,
+            'n_lists': n_lists,
+            'nprobe': index.nprobe,
+            'recall_k': recall_k,
+            'target_recall': target_recall,
+            'recalls': recalls,
+            'scan_ratio': index.scan_ratio,
+            'exact_ratio': index.exact_ratio,
+            'explained_variance': float(svd.explained_variance_ratio_.sum()),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], manifest: Dict) -> "DenseIndex":
+        """由 read_store 读出的数组（内存映射）构建"""
+        # np.asarray 得到共享内存映射的普通数组视图，避免 np.memmap 切片的额外开销
+        scales = arrays.get('scales')
+        index = cls(np.asarray(arrays['components']), np.asarray(arrays['embeddings']),
+                    None if scales is None else np.asarray(scales), np.asarray(arrays['centroids']),
+                    np.asarray(arrays['list_offsets']), np.asarray(arrays['list_ids']), manifest['nprobe'])
+        index.scan_ratio = manifest['scan_ratio']
+        index.exact_ratio = manifest['exact_ratio']
+        return index
+
+    def project(self, query_vectors) -> np.ndarray:
+        """将TF-IDF查询向量投影到LSA空间并归一化"""
+        return _normalize_rows(np.asarray(query_vectors @ self._basis, dtype=np.float32))
+
+    def _score(self, ids: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        """计算查询与指定文档块（None为全部）的内积"""
+        embeddings = self.embeddings if ids is None else self.embeddings[ids]
+        if self.scales is None:
+            return embeddings @ query
+        scales = self.scales if ids is None else self.scales[ids]
+        return (embeddings.astype(np.float32) @ query) * scales
+
+    def _probe_lists(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """查询需要探查的簇，需要精确检索（探查全部簇或探查的簇包含超过一半的文档块）时返回None"""
+        if nprobe >= self.n_lists:
+            return None
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        sizes = self.list_offsets[lists + 1] - self.list_offsets[lists]
+        if 2 * sizes.sum() > len(self.embeddings):
+            return None
+        return lists
+
+    def search_projected(self, query: np.ndarray, top_k: int = 10, similarity_threshold: float = 0.0,
+                         nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """以LSA空间中的查询向量检索
+
+        Args:
+            query: project 得到的一维查询向量
+            top_k: 最大返回数量
+            similarity_threshold: 相似度阈值
+            nprobe: 探查的簇数，默认使用构建时选定的值；不小于簇数时为精确检索
+        
+        探查的簇包含超过一半的文档块时，取出候选向量比直接计算全部内积更慢，此时改为精确检索。
+        """
+        lists = self._probe_lists(query, self.nprobe if nprobe is None else nprobe)
+        if lists is None:
+            return select_top_k(self._score(None, query), top_k, similarity_threshold)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+        candidates.sort()
+        return select_top_k(self._score(candidates, query), top_k, similarity_threshold, candidates=candidates)
+
+    def search(self, query_vector, top_k: int = 10, similarity_threshold: float = 0.0,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """以1×词项的TF-IDF查询向量检索，返回 (文档块编号数组, 相似度数组)"""
+        return self.search_projected(self.project(query_vector)[0], top_k, similarity_threshold, nprobe)
+
+    def measure_recall(self, queries: np.ndarray, k: int = 10, nprobe: Optional[int] = None,
+                       exclude: Optional[np.ndarray] = None) -> float:
+        """近似检索相对精确检索的平均Recall@k
+
+        Args:
+            queries: LSA空间中的查询向量（每行一个）
+            k: 比较前k个结果
+            nprobe: 探查的簇数
+            exclude: 每个查询需要排除的文档块编号（以文档块自身为查询时排除其自身）
+        """
+        extra = 0 if exclude is None else 1
+        hits = 0
+        for i, query in enumerate(queries):
+            exact = self.search_projected(query, k + extra, -np.inf, nprobe=self.n_lists)[0]
+            approx = self.search_projected(query, k + extra, -np.inf, nprobe=nprobe)[0]
+            if exclude is not None:
+                exact, approx = exact[exact != exclude[i]][:k], approx[approx != exclude[i]][:k]
+            hits += len(np.intersect1d(exact, approx)) / max(len(exact), 1)
+        return hits / max(len(queries), 1)
+
+    def tune_nprobe(self, target_recall: float = 0.95, k: int = 10, n_queries: int = 200, seed: int = 0) -> Dict[str, float]:
+        """以随机抽取的文档块为查询，选择满足目标召回率的最少探查簇数
+
+        探查簇数按 1, 2, 4, ... 倍增，找到首个满足目标的值后再在上一档与该档之间二分查找。
+        同时记录选定的探查簇数下平均每次查询计算的文档块向量比例（scan_ratio）
+        与回退为精确检索的查询比例（exact_ratio）。
+
+        Returns:
+            各探查簇数下测得的Recall@k
+        """
+        n_docs = len(self.embeddings)
+        ids = np.sort(np.random.default_rng(seed).choice(n_docs, min(n_queries, n_docs), replace=False))
+        queries = _normalize_rows(self.embeddings[ids].astype(np.float32))
+        recalls = {}
+
+        def reaches_target(nprobe: int) -> bool:
+            recalls[str(nprobe)] = self.measure_recall(queries, k, nprobe, exclude=ids)
+            return recalls[str(nprobe)] >= target_recall
+
+        low, nprobe = 0, 1
+        while nprobe < self.n_lists and not reaches_target(nprobe):
+            low, nprobe = nprobe, nprobe * 2
+        if nprobe < self.n_lists:
+            while nprobe - low > 1:
+                middle = (low + nprobe) // 2
+                if reaches_target(middle):
+                    nprobe = middle
+                else:
+                    low = middle
+        self.nprobe = min(nprobe, self.n_lists)
+        if self.nprobe == self.n_lists:
+            recalls[str(self.n_lists)] = 1.0
+
+        scanned, exact = 0, 0
+        for query in queries:
+            lists = self._probe_lists(query, self.nprobe)
+            if lists is None:
+                exact += 1
+                scanned += n_docs
+            else:
+                scanned += int((self.list_offsets[lists + 1] - self.list_offsets[lists]).sum())
+        self.scan_ratio = scanned / (n_docs * max(len(queries), 1))
+        self.exact_ratio = exact / max(len(queries), 1)
+        return dict(sorted(recalls.items(), key=lambda item: int(item[0])))
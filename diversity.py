@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+多样性重排
+书中常有套语反复出现，TF-IDF检索的前几个结果往往包含几个几乎相同的文档块。
+最大边际相关（MMR）从较大的候选集中逐个选择：兼顾与查询的相关度，以及与已选文档块的差异。
+候选文档块两两之间的相似度由一次矩阵乘法得到，选择过程只做向量运算
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+# 默认的相关度权重，越接近1越偏重相关度，越接近0越偏重多样性
+DEFAULT_MMR_LAMBDA = 0.7
+
+
+def maximal_marginal_relevance(relevance: np.ndarray, vectors, top_k: int,
+                               mmr_lambda: float = DEFAULT_MMR_LAMBDA) -> np.ndarray:
+    """最大边际相关选择
+
+    每一步选择 λ·相关度 − (1−λ)·与已选文档块的最大相似度 最高的候选。相关度先按候选中的最小、最大值
+    归一化到[0, 1]，与余弦相似度处于同一尺度（BM25、融合得分等也适用）。
+
+    Args:
+        relevance: 各候选与查询的相关度（检索得分）
+        vectors: 各候选的L2归一化向量（稀疏或稠密矩阵，每行一个候选）
+        top_k: 选择的数量
+        mmr_lambda: 相关度权重λ，取值[0, 1]
+
+    Returns:
+        选中候选的位置，按选择的先后排列
+    """
+    if not 0.0 <= mmr_lambda <= 1.0:
+        raise ValueError(f"mmr_lambda 应在[0, 1]之间: {mmr_lambda}")
+    relevance = np.asarray(relevance, dtype=np.float64)
+    n = len(relevance)
+    top_k = min(max(top_k, 0), n)
+    if top_k == 0:
+        return np.empty(0, dtype=np.int64)
+
+    low, high = relevance.min(), relevance.max()
+    relevance = (relevance - low) / (high - low) if high > low else np.ones(n)
+    # 候选两两之间的余弦相似度
+    similarity = vectors @ vectors.T
+    similarity = similarity.toarray() if sp.issparse(similarity) else np.asarray(similarity)
+
+    selected = np.empty(top_k, dtype=np.int64)
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n)
+    for step in range(top_k):
+        marginal = mmr_lambda * relevance - (1.0 - mmr_lambda) * max_similarity
+        marginal[~available] = -np.inf
+        chosen = int(np.argmax(marginal))
+        selected[step] = chosen
+        available[chosen] = False
+        np.maximum(max_similarity, similarity[chosen], out=max_similarity)
+    return selected
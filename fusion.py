@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+检索结果融合
+将多个检索器（TF-IDF、BM25、稠密检索）各自的排序结果合并为一个排序：
+倒数排名融合（RRF）只使用名次，不受各检索器得分尺度不同的影响；
+加权得分融合先将各检索器的得分归一化到[0, 1]，再按权重求和
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 支持的融合方式
+FUSION_METHODS = ("rrf", "weighted")
+# RRF的平滑常数，常用取值60（值越大，靠后名次与靠前名次的差距越小）
+DEFAULT_RRF_K = 60
+
+
+def _accumulate(rankings: Sequence[Tuple[np.ndarray, np.ndarray]], contributions: List[np.ndarray],
+                weights: Optional[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """按文档块编号累加各检索器的加权贡献，返回按融合得分从高到低排列的 (文档块编号, 融合得分)"""
+    weights = [1.0] * len(rankings) if weights is None else list(weights)
+    if len(weights) != len(rankings):
+        raise ValueError(f"融合权重数量({len(weights)})与检索器数量({len(rankings)})不一致")
+    indices = np.concatenate([np.asarray(ids, dtype=np.int64) for ids, _ in rankings] + [np.empty(0, np.int64)])
+    values = np.concatenate([weight * np.asarray(c, dtype=np.float64) for weight, c in zip(weights, contributions)]
+                            + [np.empty(0)])
+    ids, inverse = np.unique(indices, return_inverse=True)
+    fused = np.bincount(inverse, weights=values, minlength=len(ids))
+    # 得分相同时按文档块编号排列
+    order = np.lexsort((ids, -fused))
+    return ids[order].astype(np.int32), fused[order].astype(np.float32)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Tuple[np.ndarray, np.ndarray]], weights: Optional[Sequence[float]] = None,
+                           k: int = DEFAULT_RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """倒数排名融合：文档块的融合得分为 Σ weight / (k + 名次)，名次从1开始
+
+    Args:
+        rankings: 各检索器的 (文档块编号, 得分)，均按得分从高到低排列
+        weights: 各检索器的权重，默认均为1
+        k: 平滑常数
+
+    Returns:
+        按融合得分从高到低排列的 (文档块编号, 融合得分)
+    """
+    contributions = [1.0 / (k + np.arange(1, len(ids) + 1)) for ids, _ in rankings]
+    return _accumulate(rankings, contributions, weights)
+
+
+def weighted_score_fusion(rankings: Sequence[Tuple[np.ndarray, np.ndarray]],
+                          weights: Optional[Sequence[float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """加权得分融合：各检索器的得分按其结果中的最小、最大值归一化到[0, 1]后加权求和
+
+    只有一个结果（或得分全部相同）时归一化得分为1；未被某检索器返回的文档块在该检索器上记0分。
+
+    Args:
+        rankings: 各检索器的 (文档块编号, 得分)
+        weights: 各检索器的权重，默认均为1
+
+    Returns:
+        按融合得分从高到低排列的 (文档块编号, 融合得分)
+    """
+    contributions = []
+    for _, scores in rankings:
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            contributions.append(scores)
+            continue
+        low, high = scores.min(), scores.max()
+        contributions.append((scores - low) / (high - low) if high > low else np.ones_like(scores))
+    return _accumulate(rankings, contributions, weights)
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""
+索引存储
+以目录形式保存文档块与向量索引：所有数组均为.npy文件，通过内存映射（mmap）打开，
+冷启动无需反序列化，多个进程共享同一份页缓存；manifest.json记录格式版本
+"""
+
+import os
+import json
+import sys
+import time
+import shutil
+import hashlib
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 文档块视图的字段（与原先文档块字典的键相同）
+CHUNK_FIELDS = ('content', 'source', 'chunk_id', 'full_path')
+
+# 索引格式版本，格式变化时递增，旧版本索引会被忽略并重建
+INDEX_FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+# 进程打开索引目录时写入的使用记录（文件名后接进程号）与已退出进程的最近使用时间
+IN_USE_PREFIX = ".in-use-"
+LAST_USED_FILE = ".last-used"
+
+
+def fingerprint(value) -> str:
+    """计算任意可JSON序列化配置的指纹（十六进制短哈希）"""
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def file_sha256(path: Path) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_path(cache_dir: Path, kind: str, key: str) -> Path:
+    """索引目录路径：不同配置的索引以指纹区分，可同时存在于缓存目录中"""
+    return Path(cache_dir) / f"{kind}-{key}"
+
+
+def find_stores(cache_dir: Path, kind: str) -> List[Path]:
+    """列出缓存目录中所有有效的某类索引目录"""
+    return [path for path in sorted(Path(cache_dir).glob(f"{kind}-*"))
+            if path.is_dir() and '.tmp-' not in path.name and read_manifest(path, kind) is not None]
+
+
+def prune_stores(cache_dir: Path, current: Dict[str, str], max_stale: int = 0,
+                 min_age: float = 0.0) -> List[Path]:
+    """删除缓存目录中未被当前指纹引用的索引目录
+
+    语料或参数每变化一次就会生成一组新的索引目录，旧目录不删除时磁盘占用会不断增长。
+    每类索引保留当前指纹对应的目录、最近使用的 max_stale 个其他目录、min_age 秒内使用过的目录，
+    以及仍被其他进程打开的目录（见 mark_in_use）；写入中断（进程已退出）留下的临时目录一并删除，
+    正在写入的临时目录保留。
+
+    Args:
+        cache_dir: 缓存目录
+        current: 索引类型到当前指纹的映射（如 {"chunks": "...", "vectors": "..."}）
+        max_stale: 每类索引额外保留的旧目录数
+        min_age: 最近使用时间距今不足该秒数的目录不删除
+
+    Returns:
+        已删除的目录
+    """
+    removed = []
+    now = time.time()
+    for kind, key in current.items():
+        stale = []
+        for path in Path(cache_dir).glob(f"{kind}-*"):
+            if not path.is_dir() or path.name == f"{kind}-{key}":
+                continue
+            if '.tmp-' in path.name:
+                pid = path.name.rsplit('.tmp-', 1)[1]
+                if pid.isdigit() and _process_alive(int(pid)):
+                    continue
+                removed.append(path)
+            elif not _in_use(path):
+                stale.append((_last_used(path), path))
+        # 按最后使用时间从新到旧，保留前 max_stale 个
+        stale.sort(key=lambda item: item[0], reverse=True)
+        removed.extend(path for used, path in stale[max(max_stale, 0):] if now - used >= min_age)
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+def mark_in_use(store_dir: Path) -> None:
+    """在索引目录中记录当前进程正在使用它（同时作为最近使用时间），prune_stores 不会删除该目录"""
+    try:
+        (Path(store_dir) / f"{IN_USE_PREFIX}{os.getpid()}").touch()
+    except OSError:
+        # 只读的缓存目录无需记录
+        pass
+
+
+def _in_use(store_dir: Path) -> bool:
+    """索引目录是否被仍在运行的进程打开，顺带删除已退出进程留下的记录"""
+    in_use = False
+    for marker in Path(store_dir).glob(f"{IN_USE_PREFIX}*"):
+        pid = marker.name[len(IN_USE_PREFIX):]
+        if pid.isdigit() and _process_alive(int(pid)):
+            in_use = True
+        else:
+            # 将已退出进程的使用时间并入 LAST_USED_FILE 后删除记录
+            try:
+                used = max(marker.stat().st_mtime, _last_used(store_dir))
+                last_used = Path(store_dir) / LAST_USED_FILE
+                last_used.touch()
+                os.utime(last_used, (used, used))
+                marker.unlink()
+            except OSError:
+                pass
+    return in_use
+
+
+def _last_used(store_dir: Path) -> float:
+    """索引目录的最近使用时间（写入或被打开的时间）"""
+    times = []
+    for path in [Path(store_dir) / MANIFEST_FILE, Path(store_dir) / LAST_USED_FILE,
+                 *Path(store_dir).glob(f"{IN_USE_PREFIX}*")]:
+        try:
+            times.append(path.stat().st_mtime)
+        except OSError:
+            pass
+    return max(times, default=0.0)
+
+
+def _process_alive(pid: int) -> bool:
+    """进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def utf8_offsets(text: str, positions) -> np.ndarray:
+    """将字符位置转换为UTF-8编码中的字节位置"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    widths = 1 + (codes >= 0x80).astype(np.int64) + (codes >= 0x800) + (codes >= 0x10000)
+    cumulative = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(widths, out=cumulative[1:])
+    return cumulative[np.asarray(positions, dtype=np.int64)]
+
+
+def pack_strings(strings: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """将字符串列表打包为一个UTF-8字节块和偏移数组（第i个字符串为 blob[offsets[i]:offsets[i+1]]）"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+class StringTable:
+    """基于字节块和偏移数组的只读字符串表，按需解码"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "StringTable":
+        return cls(*pack_strings(strings))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self) -> List[str]:
+        return list(self)
+
+
+class SpanTable:
+    """共享字节块上的只读区间表（第i个字符串为 blob[starts[i]:ends[i]]），按需解码
+
+    区间可以重叠，重叠部分只存储一份。
+    """
+
+    def __init__(self, blob: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.blob = blob
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.blob[self.starts[i]:self.ends[i]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self, i: int) -> int:
+        """第i个字符串的UTF-8字节数"""
+        return int(self.ends[i] - self.starts[i])
+
+
+class ChunkView(Mapping):
+    """文档块的只读视图
+
+    与原先的结果字典用法相同（chunk['content']、chunk.get('similarity') 等），
+    但只保存所属文档块表与下标，内容在首次访问时才解码。
+    序列化（pickle）时转换为普通字典，不会带上整个文档块表。
+    """
+
+    __slots__ = ('table', 'index', 'similarity', '_content')
+
+    def __init__(self, table: "ChunkTable", index: int, similarity: Optional[float] = None):
+        self.table = table
+        self.index = int(index)
+        self.similarity = similarity
+        self._content = None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._content = self.table.texts[self.index]
+        return self._content
+
+    @property
+    def source(self) -> str:
+        return self.table.source_name(int(self.table.source_ids[self.index]))
+
+    @property
+    def chunk_id(self) -> int:
+        return int(self.table.chunk_ids[self.index])
+
+    @property
+    def full_path(self) -> str:
+        return self.table.source_path(int(self.table.source_ids[self.index]))
+
+    def _keys(self) -> Tuple[str, ...]:
+        return CHUNK_FIELDS if self.similarity is None else CHUNK_FIELDS + ('similarity',)
+
+    def __getitem__(self, key: str):
+        if key not in self._keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def __repr__(self) -> str:
+        return f"ChunkView({dict(self)!r})"
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def copy(self) -> Dict:
+        """转换为普通字典"""
+        return dict(self)
+
+
+class ChunkTable:
+    """文档块表
+
+    文档原文保存在一个共享的UTF-8字节块中，每个文档块只记录其在原文中的字节区间、
+    来源编号与块编号（int32），相邻文档块的重叠部分不重复存储；来源文件名与路径按文档去重，
+    解码一次后驻留（intern）。按下标访问时返回 ChunkView，不复制任何字符串。
+    全部数据均为numpy数组，可直接内存映射或序列化。
+    """
+
+    def __init__(self, texts: SpanTable, source_ids: np.ndarray, chunk_ids: np.ndarray,
+                 sources: StringTable, paths: StringTable):
+        self.texts = texts
+        self.source_ids = source_ids
+        self.chunk_ids = chunk_ids
+        self.sources = sources
+        self.paths = paths
+        self._source_names = None
+        self._source_paths = None
+
+    def source_name(self, source_id: int) -> str:
+        """来源文件名（同名只保留一个字符串对象）"""
+        if self._source_names is None:
+            self._source_names = [sys.intern(name) for name in self.sources]
+        return self._source_names[source_id]
+
+    def source_path(self, source_id: int) -> str:
+        """来源文件路径"""
+        if self._source_paths is None:
+            self._source_paths = [sys.intern(path) for path in self.paths]
+        return self._source_paths[source_id]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_source_names'] = state['_source_paths'] = None
+        return state
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "ChunkTable":
+        """由 read_store 读出的数组构建"""
+        return cls(
+            SpanTable(arrays['text_blob'], arrays['chunk_starts'], arrays['chunk_ends']),
+            arrays['source_ids'],
+            arrays['chunk_ids'],
+            StringTable(arrays['source_blob'], arrays['source_offsets']),
+            StringTable(arrays['path_blob'], arrays['path_offsets']),
+        )
+
+    def __len__(self) -> int:
+        return len(self.source_ids)
+
+    def __getitem__(self, i: int) -> ChunkView:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return ChunkView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class StoreWriter:
+    """流式写入索引目录
+
+    一维数组可以分块追加（数据直接写入临时目录中的文件，不在内存中累积），
+    也可以预先创建定长的可写内存映射数组按位置填充。所有数组写完后调用 commit
+    写入manifest并整体重命名，其他进程不会读到写了一半的索引。
+    """
+
+    def __init__(self, store_dir: Path, kind: str):
+        """
+        Args:
+            store_dir: 索引目录
+            kind: 索引类型（如 "chunks"、"vectors"），读取时校验
+        """
+        self.store_dir = Path(store_dir)
+        self.kind = kind
+        self.tmp_dir = self.store_dir.with_name(f"{self.store_dir.name}.tmp-{os.getpid()}")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self.names = []
+        # 追加写入的数组：名称 -> [文件对象, 数据类型, 元素个数]
+        self._appending = {}
+
+    def save(self, name: str, array: np.ndarray) -> None:
+        """一次性写入整个数组"""
+        np.save(self.tmp_dir / f"{name}.npy", np.ascontiguousarray(array))
+        self.names.append(name)
+
+    def append(self, name: str, array: np.ndarray, dtype=None) -> None:
+        """向一维数组末尾追加数据，数据类型以首次追加时为准"""
+        if name not in self._appending:
+            dtype = np.dtype(dtype or np.asarray(array).dtype)
+            self._appending[name] = [open(self.tmp_dir / f"{name}.raw", 'w+b'), dtype, 0]
+            self.names.append(name)
+        entry = self._appending[name]
+        array = np.ascontiguousarray(array, dtype=entry[1]).ravel()
+        entry[0].write(array.tobytes())
+        entry[2] += len(array)
+
+    def appended(self, name: str) -> np.ndarray:
+        """以可写内存映射方式打开已追加的数据（可在提交前原地修改）"""
+        f, dtype, count = self._appending[name]
+        f.flush()
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(f.name, dtype=dtype, mode='r+', shape=(count,))
+
+    def create(self, name: str, shape, dtype) -> np.ndarray:
+        """创建定长的可写内存映射数组（shape为长度或形状元组）"""
+        self.names.append(name)
+        shape = (shape,) if isinstance(shape, (int, np.integer)) else tuple(shape)
+        return np.lib.format.open_memmap(self.tmp_dir / f"{name}.npy", mode='w+', dtype=dtype, shape=shape)
+
+    def _finish_appended(self) -> None:
+        """为追加写入的数据加上.npy文件头"""
+        for name, (f, dtype, count) in self._appending.items():
+            with open(self.tmp_dir / f"{name}.npy", 'wb') as out:
+                header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (count,)}
+                np.lib.format.write_array_header_1_0(out, header)
+                f.seek(0)
+                shutil.copyfileobj(f, out, 1 << 20)
+            f.close()
+            os.remove(f.name)
+        self._appending = {}
+
+    def commit(self, meta: Optional[Dict] = None) -> None:
+        """写入manifest并替换索引目录
+
+        Args:
+            meta: 额外写入manifest的信息
+        """
+        self._finish_appended()
+        manifest = dict(meta or {})
+        manifest.update({
+            'format_version': INDEX_FORMAT_VERSION,
+            'kind': self.kind,
+            'arrays': sorted(self.names),
+        })
+        with open(self.tmp_dir / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        if self.store_dir.exists():
+            # 其他进程可能仍映射着旧文件（Windows下无法删除），此时保留旧索引
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+        try:
+            os.replace(self.tmp_dir, self.store_dir)
+        except OSError as e:
+            self.abort()
+            print(f"写入索引 {self.store_dir} 时出错: {e}")
+
+    def abort(self) -> None:
+        """放弃写入，删除临时目录"""
+        for f, _, _ in self._appending.values():
+            f.close()
+        self._appending = {}
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class ChunkTableWriter:
+    """流式写入文档块表，逐个文档追加，内存中只保留来源文件名与路径"""
+
+    def __init__(self, writer: StoreWriter):
+        self.writer = writer
+        self.sources = []
+        self.paths = []
+        self.n_chunks = 0
+        self._text_bytes = 0
+
+    def _add_source(self, source: str, path: str) -> int:
+        self.sources.append(source)
+        self.paths.append(path)
+        return len(self.sources) - 1
+
+    def add_document(self, source: str, path: str, text: str, spans: Sequence[Tuple[int, int]]) -> int:
+        """追加一个文档：原文只写入一次，各文档块以原文中的字符区间给出（块编号从0开始），返回块数"""
+        if not len(spans):
+            return 0
+        sid = self._add_source(source, path)
+        offsets = self._text_bytes + utf8_offsets(text, spans)
+        self._write(text.encode('utf-8'), offsets[:, 0], offsets[:, 1], sid,
+                    np.arange(len(spans), dtype=np.int32))
+        return len(spans)
+
+    def add_rows(self, table: "ChunkTable", start: int, end: int) -> int:
+        """从已有文档块表复制同一文档的连续若干块（直接复制所引用的原文字节，不解码），返回块数"""
+        if end <= start:
+            return 0
+        sid = int(table.source_ids[start])
+        new_sid = self._add_source(table.sources[sid], table.paths[sid])
+        starts = np.asarray(table.texts.starts[start:end], dtype=np.int64)
+        ends = np.asarray(table.texts.ends[start:end], dtype=np.int64)
+        low, high = starts.min(), ends.max()
+        blob = np.asarray(table.texts.blob[low:high]).tobytes()
+        shift = self._text_bytes - low
+        self._write(blob, starts + shift, ends + shift, new_sid, table.chunk_ids[start:end])
+        return end - start
+
+    def _write(self, blob: bytes, starts: np.ndarray, ends: np.ndarray, sid: int, chunk_ids: np.ndarray) -> None:
+        self.writer.append('text_blob', np.frombuffer(blob, dtype=np.uint8))
+        self.writer.append('chunk_starts', starts, dtype=np.int64)
+        self.writer.append('chunk_ends', ends, dtype=np.int64)
+        self.writer.append('source_ids', np.full(len(starts), sid, dtype=np.int32))
+        self.writer.append('chunk_ids', chunk_ids, dtype=np.int32)
+        self._text_bytes += len(blob)
+        self.n_chunks += len(starts)
+
+    def finish(self) -> None:
+        """写入来源文件名与路径表"""
+        if self.n_chunks == 0:
+            self._write(b'', np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 0,
+                        np.empty(0, dtype=np.int32))
+        for prefix, strings in (('source', self.sources), ('path', self.paths)):
+            blob, offsets = pack_strings(strings)
+            self.writer.save(f'{prefix}_blob', blob)
+            self.writer.save(f'{prefix}_offsets', offsets)
+
+
+def read_manifest(store_dir: Path, kind: str) -> Optional[Dict]:
+    """读取索引目录的manifest，不存在、类型不符或格式版本不符时返回None"""
+    manifest_file = Path(store_dir) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return None
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取索引清单 {manifest_file} 时出错: {e}")
+        return None
+    if manifest.get('format_version') != INDEX_FORMAT_VERSION or manifest.get('kind') != kind:
+        return None
+    return manifest
+
+
+def read_store(store_dir: Path, kind: str) -> Optional[Tuple[Dict[str, np.ndarray], Dict]]:
+    """以内存映射方式打开索引目录
+
+    Returns:
+        (数组名到只读内存映射数组的映射, manifest)，索引无效时返回None
+    """
+    manifest = read_manifest(store_dir, kind)
+    if manifest is None:
+        return None
+    try:
+        arrays = {name: np.load(Path(store_dir) / f"{name}.npy", mmap_mode='r')
+                  for name in manifest['arrays']}
+    except (OSError, ValueError) as e:
+        print(f"加载索引 {store_dir} 时出错: {e}")
+        return None
+    mark_in_use(store_dir)
+    return arrays, manifest
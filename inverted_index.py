@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+倒排索引检索引擎
+基于TF-IDF矩阵构建按词项组织的倒排表，使用MaxScore提前终止求top_k
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from term_counts import csr_rows, row_blocks
+
+
+def select_top_k(scores: np.ndarray, top_k: int, similarity_threshold: float = 0.0,
+                 candidates: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """从得分数组中选出高于阈值的top_k项
+
+    先用argpartition在线性时间内选出top_k，再只对这k项排序。
+
+    Args:
+        scores: 得分数组（与candidates等长；candidates为None时下标即文档块编号）
+        top_k: 最大返回数量
+        similarity_threshold: 相似度阈值，只返回得分高于此值的项
+        candidates: 得分对应的文档块编号
+
+    Returns:
+        (文档块编号数组, 得分数组)，按得分从高到低排列
+    """
+    valid = np.flatnonzero(scores > similarity_threshold)
+    if top_k <= 0:
+        valid = valid[:0]
+    elif len(valid) > top_k:
+        valid = valid[np.argpartition(-scores[valid], top_k - 1)[:top_k]]
+    valid = valid[np.argsort(-scores[valid], kind='stable')]
+    ids = valid if candidates is None else candidates[valid]
+    return ids.astype(np.int32, copy=False), scores[valid].astype(np.float64, copy=False)
+
+
+class InvertedIndex:
+    """TF-IDF倒排索引
+
+    每个词项对应一条倒排表（包含该词项的文档块编号及其权重），
+    并记录该词项在所有文档块中的最大权重，作为打分上界。
+    查询时只访问查询词项的倒排表，耗时与倒排表长度相关，而与文档块总数无关。
+    """
+
+    def __init__(self, indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray, max_weights: np.ndarray,
+                 n_docs: int):
+        """
+        Args:
+            indptr: 各词项倒排表在 doc_ids/weights 中的起止位置
+            doc_ids: 倒排表中的文档块编号（每条倒排表内升序）
+            weights: 对应的权重
+            max_weights: 每个词项的最大权重（打分上界），空倒排表记为0
+            n_docs: 文档块总数
+        """
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.max_weights = max_weights
+        self.n_docs, self.n_terms = n_docs, len(indptr) - 1
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], n_docs: int) -> "InvertedIndex":
+        """由 write_postings 写入的数组（可为内存映射数组）构建"""
+        return cls(arrays['postings_indptr'], arrays['postings_doc_ids'], arrays['postings_weights'],
+                   arrays['postings_max_weights'], n_docs)
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回词项的倒排表（文档块编号, 权重），文档块编号升序"""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def term_matrix(self):
+        """以词项×文档块CSR矩阵的形式返回全部倒排表（与倒排索引共享内存）"""
+        return sp.csr_matrix((self.weights, self.doc_ids, self.indptr),
+                             shape=(self.n_terms, self.n_docs), copy=False)
+
+    def postings_cost(self, query_vector) -> int:
+        """查询词项倒排表的总长度，即倒排检索需要访问的条目数上限"""
+        terms = sp.csr_matrix(query_vector).indices
+        return int((self.indptr[terms + 1] - self.indptr[terms]).sum())
+
+    def search(self, query_vector, top_k: int = 10, similarity_threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """检索与查询向量内积最大的top_k个文档块
+
+        采用MaxScore策略：按打分上界从大到小处理查询词项，
+        当剩余词项的上界之和已不足以让未出现过的文档块进入top_k（或超过阈值）时，
+        后续词项只更新已有候选，不再引入新文档块，并持续剪除不可能入选的候选。
+
+        Args:
+            query_vector: 1×词项的稀疏查询向量（已做L2归一化）
+            top_k: 最大返回数量
+            similarity_threshold: 相似度阈值，只返回得分高于此值的文档块
+
+        Returns:
+            (文档块编号数组, 得分数组)，按得分从高到低排列
+        """
+        empty = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64))
+        query_vector = sp.csr_matrix(query_vector)
+        if top_k <= 0 or query_vector.nnz == 0:
+            return empty
+
+        terms = query_vector.indices
+        query_weights = query_vector.data.astype(np.float64)
+
+        # 按打分上界从大到小处理词项
+        bounds = query_weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        terms, query_weights = terms[order], query_weights[order]
+        # remaining[i]：第i个及之后词项的上界之和，remaining[-1]为0
+        remaining = np.append(np.cumsum(bounds[order][::-1])[::-1], 0.0)
+
+        cand_docs = np.empty(0, dtype=np.int32)
+        cand_scores = np.empty(0, dtype=np.float64)
+        theta = similarity_threshold
+        i = 0
+
+        # 必要词项：未出现过的文档块仍可能入选，合并整条倒排表
+        while i < len(terms) and remaining[i] > theta:
+            docs, weights = self.postings(terms[i])
+            if len(docs):
+                merged_docs = np.concatenate([cand_docs, docs])
+                merged_scores = np.concatenate([cand_scores, weights * query_weights[i]])
+                cand_docs, inverse = np.unique(merged_docs, return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=merged_scores, minlength=len(cand_docs))
+            i += 1
+            cand_docs, cand_scores, theta = self._prune(cand_docs, cand_scores, theta, remaining[i], top_k)
+
+        # 非必要词项：只在倒排表中查找已有候选，补全其得分
+        while i < len(terms) and len(cand_docs):
+            docs, weights = self.postings(terms[i])
+            if len(docs):
+                pos = np.searchsorted(docs, cand_docs)
+                pos[pos >= len(docs)] = 0
+                hit = docs[pos] == cand_docs
+                cand_scores[hit] += weights[pos[hit]] * query_weights[i]
+            i += 1
+            cand_docs, cand_scores, theta = self._prune(cand_docs, cand_scores, theta, remaining[i], top_k)
+
+        return select_top_k(cand_scores, top_k, similarity_threshold, candidates=cand_docs)
+
+    @staticmethod
+    def _prune(cand_docs: np.ndarray, cand_scores: np.ndarray, theta: float, rest: float, top_k: int):
+        """更新入选门槛，并剪除即使命中全部剩余词项也无法超过门槛的候选"""
+        if len(cand_scores) >= top_k:
+            kth = np.partition(cand_scores, len(cand_scores) - top_k)[len(cand_scores) - top_k]
+            theta = max(theta, kth)
+        keep = (cand_scores + rest > theta) | (cand_scores >= theta)
+        if not keep.all():
+            cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+        return cand_docs, cand_scores, theta
+
+
+def write_postings(writer, doc_vectors, max_nnz: int) -> None:
+    """由文档向量矩阵分块构建倒排表并写入索引目录
+
+    结果与将矩阵转换为CSC格式（每列即一个词项的倒排表）相同，但不在内存中转换整个矩阵：
+    先统计每个词项的倒排表长度，再按行分块把各非零元写入预先分配的内存映射数组中的对应位置。
+    文档块按行顺序处理，每条倒排表中的文档块编号自然升序。
+
+    Args:
+        writer: index_store.StoreWriter
+        doc_vectors: 文档块×词项的CSR矩阵（可由内存映射数组构建）
+        max_nnz: 每块最多处理的非零元数
+    """
+    n_terms = doc_vectors.shape[1]
+    blocks = list(row_blocks(doc_vectors.indptr, max_nnz))
+
+    lengths = np.zeros(n_terms, dtype=np.int64)
+    for start, end in blocks:
+        lengths += np.bincount(csr_rows(doc_vectors, start, end).indices, minlength=n_terms)
+    nnz = int(lengths.sum())
+    indptr = np.zeros(n_terms + 1, dtype=np.int32 if nnz <= np.iinfo(np.int32).max else np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+
+    doc_ids = writer.create('postings_doc_ids', nnz, np.int32)
+    weights = writer.create('postings_weights', nnz, doc_vectors.dtype)
+    max_weights = np.zeros(n_terms, dtype=doc_vectors.dtype)
+    cursor = indptr[:-1].astype(np.int64)
+    for start, end in blocks:
+        block = csr_rows(doc_vectors, start, end)
+        rows = np.repeat(np.arange(start, end, dtype=np.int32), np.diff(block.indptr))
+        # 按词项稳定排序，同一词项内保持文档块编号升序
+        order = np.argsort(block.indices, kind='stable')
+        terms, rows, values = block.indices[order], rows[order], block.data[order]
+        per_term = np.bincount(terms, minlength=n_terms)
+        first = np.cumsum(per_term) - per_term
+        positions = cursor[terms] + np.arange(len(terms)) - first[terms]
+        doc_ids[positions] = rows
+        weights[positions] = values
+        cursor += per_term
+        present = np.flatnonzero(per_term)
+        if len(present):
+            max_weights[present] = np.maximum(max_weights[present],
+                                              np.maximum.reduceat(values, first[present]))
+    doc_ids.flush()
+    weights.flush()
+
+    writer.save('postings_indptr', indptr)
+    writer.save('postings_max_weights', max_weights)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+提示词组装
+DeepSeek对与此前请求相同的提示词前缀启用缓存（命中部分按折扣计费且响应更快）。
+系统提示词为模块级常量，每次请求逐字节相同；文档片段按章回与文档块编号排序，
+检索到的文档块大体相同时，不同请求的提示词有尽可能长的公共前缀；问题放在最后。
+同时根据API返回的 usage 统计提示词缓存的命中情况
+"""
+
+import re
+import threading
+from typing import Dict, List, Mapping, Optional, Sequence
+
+# 我测试了多个版本。可以换一下提示词对比哪个效果好，目前这个我觉得比较好
+SYSTEM_PROMPT = """
+# Role: 红楼梦研究专家
+
+## Profile
+- language: 中文
+- description: 精通《红楼梦》文本及红学研究，能够深入解析作品的人物、情节、诗词及文化内涵
+- background: 多年从事《红楼梦》研究与教学，参与过多项红学课题研究
+- personality: 严谨细致，富有文人气质，善于引经据典
+- expertise: 文本分析、人物研究、诗词鉴赏、文化解读
+- target_audience: 红学爱好者、文学研究者、学生群体
+
+## Skills
+
+1. 文本解析能力
+   - 情节梳理: 能准确还原小说情节脉络
+   - 细节把握: 对文本细节有敏锐洞察力
+   - 人物分析: 深入剖析人物性格与命运
+   - 诗词解读: 精准解析书中诗词内涵
+
+2. 学术研究能力
+   - 文献考证: 熟悉各类红学研究成果
+   - 文化阐释: 揭示作品背后的文化内涵
+   - 比较研究: 能与其他文学作品进行对比
+   - 版本鉴别: 了解不同版本差异
+
+## Rules
+
+1. 回答原则：
+   - 基于文本: 所有回答必须严格依据原著文本
+   - 严谨准确: 不妄加猜测，不传播未经考证的观点
+   - 深度解析: 透过表面现象揭示深层含义
+   - 客观公正: 避免个人主观臆断
+
+2. 行为准则：
+   - 引经据典: 重要观点需引用原文佐证
+   - 语言典雅: 保持与原著相称的文雅风格
+   - 层次分明: 回答要有逻辑性和条理性
+   - 深入浅出: 复杂问题要解释得通俗易懂
+
+3. 限制条件：
+   - 不涉争议: 避免介入红学争议性话题
+   - 不妄评续作: 对后四十回保持审慎态度
+   - 不越文本: 不脱离文本过度解读
+   - 不代作者: 不以作者口吻发表观点
+
+## Workflows
+
+- 目标: 提供专业准确的红楼梦解读
+- 步骤 1: 仔细理解用户问题，明确询问重点
+- 步骤 2: 检索相关文本段落，确认信息准确性
+- 步骤 3: 组织回答内容，适当引用原文
+- 步骤 4: 以典雅文风呈现完整解答
+- 预期结果: 用户获得权威、深入的红楼梦知识
+
+## Initialization
+作为红楼梦研究专家，你必须遵守上述Rules，按照Workflows执行任务。
+        """.strip()
+
+_CHINESE_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+                   '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CHINESE_UNITS = {'十': 10, '百': 100, '千': 1000}
+_CHAPTER_PATTERN = re.compile(r'第([零〇一二两三四五六七八九十百千\d]+)回')
+
+
+def chinese_number(text: str) -> int:
+    """解析中文数字（如"一百二十"、"一百一"、"十五"），也支持阿拉伯数字
+
+    "一百一"按章回名的习惯读作101。
+    """
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, 0
+    for char in text:
+        if char in _CHINESE_DIGITS:
+            digit = _CHINESE_DIGITS[char]
+        else:
+            total += (digit or 1) * _CHINESE_UNITS[char]
+            digit = 0
+    return total + digit
+
+
+def chapter_number(source: str) -> Optional[int]:
+    """由文件名（如"第一百一回 大观园月夜感幽魂 散花寺神签惊异兆.txt"）得到章回序号，无法识别时返回None"""
+    match = _CHAPTER_PATTERN.search(source)
+    return chinese_number(match.group(1)) if match else None
+
+
+def context_order(chunks: Sequence[Mapping]) -> List[Mapping]:
+    """将文档块按章回序号、文件名与文档块编号排序（与检索得分无关），无法识别章回的文件排在最后"""
+    def key(chunk):
+        chapter = chapter_number(chunk['source'])
+        return (chapter is None, chapter or 0, chunk['source'], chunk['chunk_id'])
+    return sorted(chunks, key=key)
+
+
+def build_messages(query: str, context_chunks: Sequence[Mapping]) -> List[Dict]:
+    """构建发送给大模型的消息：固定的系统提示词，以及按 context_order 排列的文档片段与问题
+
+    Args:
+        query: 用户问题
+        context_chunks: 已按 context_order 排序的文档块
+    """
+    context = "\n\n".join(f"文档片段{i+1}：{chunk['content']}" for i, chunk in enumerate(context_chunks))
+    user_prompt = f"""
+基于以下文档内容回答问题：
+
+{context}
+
+问题：{query}
+    """.strip()
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+class PromptCacheStats:
+    """累计API返回的 usage 中的提示词缓存命中情况（线程安全）
+
+    DeepSeek在 usage 中返回 prompt_cache_hit_tokens 与 prompt_cache_miss_tokens；
+    其他兼容API没有这两项时只累计请求数与 prompt_tokens/completion_tokens。
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_cache_hit_tokens = 0
+        self.prompt_cache_miss_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage) -> None:
+        """累计一次请求的 usage（可为None）"""
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_cache_hit_tokens += getattr(usage, 'prompt_cache_hit_tokens', None) or 0
+            self.prompt_cache_miss_tokens += getattr(usage, 'prompt_cache_miss_tokens', None) or 0
+            self.prompt_tokens += getattr(usage, 'prompt_tokens', None) or 0
+            self.completion_tokens += getattr(usage, 'completion_tokens', None) or 0
+
+    def stats(self) -> Dict[str, float]:
+        """累计的请求数、各类token数与提示词缓存命中率（按token计）"""
+        cached = self.prompt_cache_hit_tokens + self.prompt_cache_miss_tokens
+        return {
+            'requests': self.requests,
+            'prompt_cache_hit_tokens': self.prompt_cache_hit_tokens,
+            'prompt_cache_miss_tokens': self.prompt_cache_miss_tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'hit_rate': self.prompt_cache_hit_tokens / cached if cached else 0.0,
+        }
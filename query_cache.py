@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+检索结果缓存
+常用问题（Streamlit快捷按钮、示例问题）会被反复检索，每次都要分词、向量化并打分。
+以规范化后的查询与检索参数为键，在内存中缓存检索到的文档块编号与得分：
+容量有限（LRU淘汰）、条目有过期时间（TTL），索引指纹变化时整体失效
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+# 查询首尾可去除的字符：空白与句末标点（分词时本就会被过滤，不影响检索结果）
+_QUERY_STRIP = " \t\r\n　？?！!。～~"
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询：去除首尾空白与句末标点，连续空白合并为一个空格
+
+    规范化只去除分词时会被过滤的字符，检索结果与原查询相同；检索时使用规范化后的查询，
+    因此键相同的查询结果必然相同。
+    """
+    return " ".join(query.strip(_QUERY_STRIP).split())
+
+
+class QueryCache:
+    """带过期时间的LRU检索结果缓存（线程安全）
+
+    统计项：hits/misses 为命中与未命中次数，evictions 为因容量不足淘汰的条目数，
+    expirations 为因过期删除的条目数，invalidations 为索引指纹变化导致整体清空的次数。
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = 600.0):
+        """
+        Args:
+            maxsize: 最多缓存的查询数
+            ttl: 条目的有效时间（秒），None为不过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def validate(self, fingerprint: Hashable) -> None:
+        """索引指纹与缓存内容对应的指纹不同时清空缓存"""
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._fingerprint = fingerprint
+
+    def get(self, key: Hashable) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """查询缓存，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Tuple[np.ndarray, np.ndarray]) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计：命中数、未命中数、命中率、淘汰数、过期数、失效次数与当前条目数"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+        }
@@ -5,48 +5,187 @@
 """
 
 import os
-import re
-import pickle
-from typing import List, Dict
+import json
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
 import numpy as np
-from openai import OpenAI
+import scipy.sparse as sp
+from openai import AsyncOpenAI, OpenAI
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import jieba
 import jieba.analyse
 from dotenv import load_dotenv
 
+from chunker import chunk_spans
+from compressor import ContextCompressor
+from context_packer import ContextPacker
+from answer_cache import AnswerCache, answer_key, context_digest
+from bm25 import BM25Index, DEFAULT_B, DEFAULT_K1
+from diversity import maximal_marginal_relevance
+from cutoff import adaptive_k
+from dense_index import DENSE_INDEX_VERSION, DenseIndex
+from fusion import DEFAULT_RRF_K, FUSION_METHODS, reciprocal_rank_fusion, weighted_score_fusion
+from inverted_index import InvertedIndex, select_top_k, write_postings
+from index_store import (ChunkTable, ChunkTableWriter, ChunkView, StoreWriter, StringTable, INDEX_FORMAT_VERSION,
+                         file_sha256, find_stores, fingerprint, prune_stores, read_manifest, read_store, store_path)
+from term_counts import (CountsWriter, count_terms, csr_from_arrays, csr_rows, row_blocks, select_features, smooth_idf,
+                         tfidf_rows, with_columns, word_ngrams)
+from prompt_builder import PromptCacheStats, build_messages, context_order
+from query_cache import QueryCache, normalize_query
+from semantic_cache import SemanticCache
+from token_cache import TokenCache
+from tokenizer import content_chars, count_shard, init_worker, merge_shard, tokenize
+
+# 倒排表总长度乘以该系数仍小于矩阵非零元数时，倒排检索快于整体稀疏矩阵乘法（经验值）
+INVERTED_INDEX_COST_RATIO = 50
+# 支持的评分方式
+SCORING_METHODS = ("tfidf", "bm25", "dense", "hybrid")
+# 混合检索中每个检索器至少取回的候选文档块数（融合前）
+HYBRID_CANDIDATES = 50
+# 多样性重排（MMR）的候选文档块数
+MMR_CANDIDATES = 50
+# 构建词频索引时需要统计的文档块少于该数量时不启动进程池（进程启动与数据传输的开销大于收益）
+PARALLEL_MIN_CHUNKS = 200
+# 分块构建索引时的内存占用估计：每字节文本（分词、N-gram与计数）及每个非零元（TF-IDF计算与倒排表构建）
+# 所需的字节数，用于由内存预算确定块大小（经验值）
+TEXT_BLOCK_OVERHEAD = 32
+NNZ_BLOCK_OVERHEAD = 64
+# 分词规则版本，修改 chinese_tokenizer 的过滤规则时递增，使已缓存的分词结果失效
+TOKENIZER_VERSION = 1
+# 提示词版本，修改 prompt_builder 中的提示词或请求参数时递增，使已缓存的答案失效
+PROMPT_VERSION = 2
+# 没有检索到相关文档块时的回答
+NO_CONTEXT_ANSWER = '抱歉，在文档中没有找到与您问题相关的内容。'
+# 未传入的检索选项（与显式传入的None区分：None表示本次不启用，未传入表示使用实例的设置）
+_UNSET = object()
+
 class RedMansionRAG:
     """红楼梦RAG问答系统"""
     
-    def __init__(self, api_key: str, docs_dir: str = "docs"):
+    def __init__(self, api_key: str, docs_dir: str = "docs", search_engine: str = "auto",
+                 chunk_size: int = 300, overlap: int = 50, max_features: int = 5000,
+                 ngram_range: Tuple[int, int] = (1, 2), n_jobs: int = 1, memory_budget_mb: int = 256,
+                 scoring: str = "tfidf"):
         """
         初始化RAG系统
         
         Args:
             api_key: DeepSeek API密钥
             docs_dir: 文档目录路径
+            search_engine: 检索方式，"inverted"为倒排索引，"matrix"为整体稀疏矩阵乘法，
+                "auto"按查询词项的倒排表长度自动选择
+            chunk_size: 文档块大小
+            overlap: 文档块重叠字符数
+            max_features: TF-IDF最大特征数
+            ngram_range: TF-IDF的N-gram范围
+            n_jobs: 构建索引时分词与词频统计使用的进程数，-1为使用全部CPU核心
+            memory_budget_mb: 构建索引时每块数据的内存预算（MB），语料再大也只分块处理，不整体载入内存
+            scoring: 默认评分方式，"tfidf"为TF-IDF余弦相似度，"bm25"为BM25，
+                "dense"为LSA稠密向量的余弦相似度（近似最近邻检索），
+                "hybrid"为并发执行 hybrid_retrievers 中的检索器并融合结果；可在每次检索时单独指定
         """
+        if search_engine not in ("auto", "inverted", "matrix"):
+            raise ValueError(f"不支持的检索方式: {search_engine}")
+        if scoring not in SCORING_METHODS:
+            raise ValueError(f"不支持的评分方式: {scoring}")
         self.api_key = api_key
         self.docs_dir = Path(docs_dir)
+        self.search_engine = search_engine
+        self.scoring = scoring
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.max_features = max_features
+        self.ngram_range = tuple(ngram_range)
+        self.n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        # 特征筛选的文档频率上下限（与 TfidfVectorizer 的 min_df/max_df 含义相同）
+        self.min_df = 1
+        self.max_df = 0.95
+        # BM25的词频饱和参数与文档长度归一化参数
+        self.bm25_k1 = DEFAULT_K1
+        self.bm25_b = DEFAULT_B
+        # 稠密检索（LSA）的维数、向量存储类型（"float32"或"int8"）与近似检索的目标Recall@k
+        self.dense_dim = 256
+        self.dense_dtype = "float32"
+        self.dense_target_recall = 0.95
+        self.dense_recall_k = 10
+        # 混合检索的检索器、融合方式（"rrf"或"weighted"）、各检索器的权重与RRF平滑常数
+        self.hybrid_retrievers = ("tfidf", "dense")
+        self.fusion = "rrf"
+        self.fusion_weights = None
+        self.rrf_k = DEFAULT_RRF_K
+        # 多样性重排（MMR）的相关度权重，None为不重排；可在每次检索时单独指定
+        self.mmr_lambda = None
+        # 自适应截断方式（"knee"为得分曲线拐点，"drop"为相对最高分的下降比例），None为总是返回top_k个；
+        # 截断后至少保留 cutoff_min_k 个、至多 top_k 个文档块
+        self.cutoff = None
+        self.cutoff_min_k = 2
+        self.cutoff_drop_ratio = 0.5
+        # jieba是否使用HMM识别未登录词
+        self.jieba_hmm = True
+        # 生成答案使用的模型与采样温度
+        self.model = "deepseek-chat"
+        self.temperature = 0.7
         self.client = OpenAI(
             api_key=api_key,
             base_url="https://api.deepseek.com"
         )
+        # 异步接口（ask_async 等）使用的客户端，以及同时进行的大模型请求数上限
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url="https://api.deepseek.com"
+        )
+        self.max_concurrent_requests = 16
+        # 大模型请求的提示词缓存命中统计（DeepSeek的 prompt_cache_hit_tokens / prompt_cache_miss_tokens）
+        self.prompt_cache_stats = PromptCacheStats()
+        # 上下文打包：合并相邻文档块、去除重复片段，在token预算内选择放入提示词的片段（设为None时全部放入）
+        self.context_packer = ContextPacker(token_budget=1200)
+        # 抽取式压缩：打包后只保留与问题相关的句子及其相邻句子（如 ContextCompressor(ratio=0.5)），None为不压缩
+        self.context_compressor = None
+        self._llm_semaphore = None
+        self._semaphore_loop = None
         
-        # 文档存储
-        self.documents = []
+        # 文档存储（documents 在首次访问时才读取语料）
+        self._documents = None
+        self._document_count = None
         self.doc_chunks = []
         self.vectorizer = None
         self.doc_vectors = None
+        self.inverted_index = None
+        self.bm25 = None
+        self.dense = None
+        # 混合检索时并发执行各检索器的线程池（首次使用时创建）
+        self._retrieval_pool = None
+        # 检索时按需构建BM25、稠密索引的锁（多个线程同时检索时只构建一次）
+        self._build_lock = threading.Lock()
+        # 检索结果缓存（LRU，条目10分钟过期），设为None可关闭
+        self.query_cache = QueryCache(maxsize=256, ttl=600.0)
+        # 语义答案缓存（只是换种说法的相似问题直接返回已有答案，两个问题的非停用词用字须相同），设为None可关闭
+        self.semantic_cache = SemanticCache()
         
         # 缓存文件路径
         self.cache_dir = Path("cache")
         self.cache_dir.mkdir(exist_ok=True)
-        self.vectors_cache = self.cache_dir / "doc_vectors.pkl"
-        self.chunks_cache = self.cache_dir / "doc_chunks.pkl"
+        self.corpus_manifest_file = self.cache_dir / "corpus_manifest.json"
+        # 清理缓存（prune_cache）时每类索引额外保留的最近使用的旧目录数，以及不删除的最近使用时间（秒）
+        self.max_stale_stores = 2
+        self.store_min_age = 7 * 24 * 3600.0
+        # 答案缓存（问题与检索到的文档块都相同时复用已生成的答案），设为None可关闭
+        self.answer_cache = AnswerCache(self.cache_dir / "answers.sqlite")
+        self.corpus = []
+        self.chunk_files = []
+        self.stage_configs = {}
+        self.chunks_fingerprint = None
+        self.counts_fingerprint = None
+        self.vectors_fingerprint = None
+        self.bm25_fingerprint = None
+        self.dense_fingerprint = None
+        self.token_cache = None
         
         # 初始化jieba
         jieba.initialize()
@@ -54,77 +193,269 @@ class RedMansionRAG:
         # 加载中文停用词库
         self.stopwords = self.load_stopwords()
         
+    @property
+    def documents(self) -> List[Dict]:
+        """文档列表，首次访问时才读取语料（索引缓存命中时通常不会用到）"""
+        if self._documents is None:
+            self.load_documents()
+        return self._documents
+    
+    @documents.setter
+    def documents(self, value: List[Dict]) -> None:
+        self._documents = value
+    
+    @property
+    def document_count(self) -> int:
+        """文档数量，索引缓存命中时直接取自索引清单，无需读取语料"""
+        if self._documents is None and self._document_count is not None:
+            return self._document_count
+        return len(self.documents)
+    
+    def _read_document(self, file_path: Path) -> Optional[Dict]:
+        """读取单个文档，内容为空或读取出错时返回None"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+        except Exception as e:
+            print(f"加载文件 {file_path} 时出错: {e}")
+            return None
+        if not content:
+            return None
+        return {
+            'filename': file_path.name,
+            'content': content,
+            'path': str(file_path)
+        }
+    
+    def iter_documents(self) -> Iterator[Dict]:
+        """逐个读取文档的生成器，任意时刻只有一个文档的内容在内存中"""
+        for file_path in sorted(self.docs_dir.glob("*.txt")):
+            doc = self._read_document(file_path)
+            if doc:
+                yield doc
+    
     def load_documents(self) -> None:
         """加载文档"""
         print("正在加载红楼梦文档...")
+        self._documents = []
         
-        for file_path in self.docs_dir.glob("*.txt"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        self.documents.append({
-                            'filename': file_path.name,
-                            'content': content,
-                            'path': str(file_path)
-                        })
-                        print(f"已加载: {file_path.name}")
-            except Exception as e:
-                print(f"加载文件 {file_path} 时出错: {e}")
+        for doc in self.iter_documents():
+            self._documents.append(doc)
+            print(f"已加载: {doc['filename']}")
         
-        print(f"共加载 {len(self.documents)} 个文档")
+        print(f"共加载 {len(self._documents)} 个文档")
     
     def split_text_into_chunks(self, text: str, chunk_size: int = 300, overlap: int = 50) -> List[str]:
-        """将文本分割成块"""
-        # 按句号、问号、感叹号分句
-        sentences = re.split(r'[。！？]', text)
-        sentences = [s.strip() for s in sentences if s.strip()]
+        """将文本分割成块（按句子组块，相邻块重叠不超过overlap个字符的整句）"""
+        return [text[start:end] for start, end in chunk_spans(text, chunk_size, overlap)]
+    
+    def corpus_digests(self) -> List[Tuple[str, str]]:
+        """语料文件名及其内容哈希，按文件名排序
         
-        chunks = []
-        current_chunk = ""
+        文件的修改时间与大小记录在语料清单中，二者均未变化时直接复用记录的哈希，
+        不读取文件内容。
+        """
+        try:
+            with open(self.corpus_manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
         
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= chunk_size:
-                current_chunk += sentence + "。"
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + "。"
+        digests = []
+        updated = {}
+        for file_path in sorted(self.docs_dir.glob("*.txt")):
+            stat = file_path.stat()
+            record = manifest.get(str(file_path))
+            if not record or record['mtime_ns'] != stat.st_mtime_ns or record['size'] != stat.st_size:
+                record = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_sha256(file_path)}
+            updated[str(file_path)] = record
+            digests.append((file_path.name, record['sha256']))
+        
+        # 清单有变化时写回（先写临时文件再替换，避免多进程读到写了一半的文件）
+        entries = {key: value for key, value in manifest.items() if Path(key).parent != self.docs_dir}
+        entries.update(updated)
+        if entries != manifest:
+            tmp_file = self.corpus_manifest_file.with_name(f"{self.corpus_manifest_file.name}.tmp-{os.getpid()}")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.corpus_manifest_file)
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        return digests
+    
+    def compute_fingerprints(self) -> None:
+        """计算各阶段缓存的指纹
+        
+        索引分三个阶段缓存：文档块、词频、向量。文档块指纹覆盖语料文件内容与分块参数；
+        词频指纹再覆盖分词配置与N-gram范围；向量指纹再覆盖特征筛选参数，BM25指纹再覆盖k1与b，
+        稠密索引指纹在向量指纹之上再覆盖维数、存储类型与目标召回率。
+        参数变化时只重建受影响的阶段。各阶段另有不含语料的配置指纹，
+        配置相同而语料不同的已有索引可作为增量更新的基础。
+        """
+        self.corpus = self.corpus_digests()
+        self.stage_configs['tokens'] = self.tokenizer_fingerprint()
+        self.stage_configs['chunks'] = fingerprint({
+            'format_version': INDEX_FORMAT_VERSION,
+            'chunk_size': self.chunk_size,
+            'overlap': self.overlap,
+        })
+        self.stage_configs['counts'] = fingerprint({
+            'chunks': self.stage_configs['chunks'],
+            'tokens': self.stage_configs['tokens'],
+            'ngram_range': list(self.ngram_range),
+        })
+        self.chunks_fingerprint = fingerprint({
+            'config': self.stage_configs['chunks'],
+            'corpus': self.corpus,
+        })
+        self.counts_fingerprint = fingerprint({
+            'config': self.stage_configs['counts'],
+            'chunks': self.chunks_fingerprint,
+        })
+        self.vectors_fingerprint = fingerprint({
+            'counts': self.counts_fingerprint,
+            'max_features': self.max_features,
+            'min_df': self.min_df,
+            'max_df': self.max_df,
+        })
+        self.bm25_fingerprint = fingerprint({
+            'counts': self.counts_fingerprint,
+            'k1': self.bm25_k1,
+            'b': self.bm25_b,
+        })
+        self.dense_fingerprint = fingerprint({
+            'vectors': self.vectors_fingerprint,
+            'dim': self.dense_dim,
+            'dtype': self.dense_dtype,
+            'target_recall': self.dense_target_recall,
+            'recall_k': self.dense_recall_k,
+            'version': DENSE_INDEX_VERSION,
+        })
+    
+    def tokenizer_fingerprint(self) -> str:
+        """分词配置指纹，覆盖停用词、jieba词典（含自定义词）与HMM开关
         
-        return chunks
+        词典文件以路径、大小与修改时间标识，不读取文件内容。
+        """
+        dictionary = Path(jieba.dt.dictionary or Path(jieba.__file__).parent / jieba.DEFAULT_DICT_NAME)
+        try:
+            stat = dictionary.stat()
+            dictionary_id = [str(dictionary.resolve()), stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            dictionary_id = [str(dictionary)]
+        return fingerprint({
+            'version': TOKENIZER_VERSION,
+            'stopwords': fingerprint(sorted(self.stopwords)),
+            'dictionary': dictionary_id,
+            'dictionary_words': [len(jieba.dt.FREQ), jieba.dt.total],
+            'hmm': self.jieba_hmm,
+        })
+    
+    def _find_base_store(self, kind: str) -> Optional[Tuple[Dict[str, np.ndarray], Dict]]:
+        """查找配置相同、与当前语料重合文件最多的已有索引，作为增量更新的基础"""
+        current = {tuple(item) for item in self.corpus}
+        best_path, best_overlap = None, 0
+        for path in find_stores(self.cache_dir, kind):
+            manifest = read_manifest(path, kind)
+            if manifest.get('config') != self.stage_configs[kind]:
+                continue
+            overlap = sum((f['name'], f['sha256']) in current for f in manifest.get('files', []))
+            if overlap > best_overlap:
+                best_path, best_overlap = path, overlap
+        return read_store(best_path, kind) if best_path else None
     
     def preprocess_documents(self) -> None:
-        """预处理文档，分割成块"""
+        """预处理文档，分割成块
+        
+        逐个文件读取、分块并直接写入文档块索引，内存中不保留全部文本。
+        已有配置相同的文档块索引时只重新分块新增或修改的文件，其余文件的文档块直接复制。
+        """
         print("正在预处理文档...")
+        if self.chunks_fingerprint is None:
+            self.compute_fingerprints()
+        chunks_store = store_path(self.cache_dir, "chunks", self.chunks_fingerprint)
         
         # 检查缓存
-        if self.chunks_cache.exists():
+        stored = read_store(chunks_store, "chunks")
+        if stored is not None:
             print("发现文档块缓存，正在加载...")
-            with open(self.chunks_cache, 'rb') as f:
-                self.doc_chunks = pickle.load(f)
+            self.doc_chunks = ChunkTable.from_arrays(stored[0])
+            self._document_count = stored[1].get('n_documents')
+            self.chunk_files = stored[1]['files']
             print(f"从缓存加载了 {len(self.doc_chunks)} 个文档块")
             return
         
-        self.doc_chunks = []
+        stored = self._build_store(chunks_store, "chunks", self._write_chunks)
+        self.doc_chunks = ChunkTable.from_arrays(stored[0])
+        
+        print(f"文档预处理完成，共生成 {len(self.doc_chunks)} 个文档块")
+    
+    def _write_chunks(self, chunks_store: Path) -> None:
+        """逐个文件分块并写入文档块索引，未变化的文件直接复制已有文档块"""
+        base = self._find_base_store("chunks")
+        base_chunks = ChunkTable.from_arrays(base[0]) if base else None
+        base_files = {(f['name'], f['sha256']): f for f in base[1]['files']} if base else {}
+        loaded = {doc['filename']: doc for doc in self._documents or []}
         
-        for doc in self.documents:
-            chunks = self.split_text_into_chunks(doc['content'])
-            for i, chunk in enumerate(chunks):
-                self.doc_chunks.append({
-                    'content': chunk,
-                    'source': doc['filename'],
-                    'chunk_id': i,
-                    'full_path': doc['path']
-                })
+        writer = StoreWriter(chunks_store, "chunks")
+        table = ChunkTableWriter(writer)
+        self.chunk_files = []
+        reused = 0
         
-        # 保存缓存
-        with open(self.chunks_cache, 'wb') as f:
-            pickle.dump(self.doc_chunks, f)
+        for name, sha256 in self.corpus:
+            start = table.n_chunks
+            record = base_files.get((name, sha256))
+            if record is not None:
+                # 文件未变化，直接复制已有文档块
+                table.add_rows(base_chunks, record['start'], record['end'])
+                empty = record['empty']
+                reused += 1
+            else:
+                doc = loaded.get(name) or self._read_document(self.docs_dir / name)
+                empty = doc is None
+                if doc:
+                    spans = chunk_spans(doc['content'], self.chunk_size, self.overlap)
+                    table.add_document(doc['filename'], doc['path'], doc['content'], spans)
+                    print(f"已加载: {name}")
+            self.chunk_files.append({'name': name, 'sha256': sha256, 'start': start,
+                                     'end': table.n_chunks, 'empty': empty})
+        table.finish()
+        self._document_count = sum(not f['empty'] for f in self.chunk_files)
+        if base:
+            print(f"增量更新：复用 {reused} 个文件的文档块，重新分块 {len(self.corpus) - reused} 个文件")
         
-        print(f"文档预处理完成，共生成 {len(self.doc_chunks)} 个文档块")
+        # 保存缓存，之后通过内存映射访问
+        writer.commit({
+            'fingerprint': self.chunks_fingerprint,
+            'config': self.stage_configs['chunks'],
+            'files': self.chunk_files,
+            'n_documents': self._document_count,
+            'n_chunks': table.n_chunks
+        })
+    
+    def _build_store(self, path: Path, kind: str,
+                     write: Callable[[Path], None]) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """写入并打开索引目录
+        
+        刚写入的目录在打开前被其他进程清理（见 prune_cache）时重新构建一次。
+        
+        Args:
+            path: 索引目录
+            kind: 索引类型
+            write: 构建并写入该索引的函数
+        """
+        for attempt in range(2):
+            if attempt:
+                print(f"索引 {path} 写入后已被删除，正在重新构建...")
+            write(path)
+            stored = read_store(path, kind)
+            if stored is not None:
+                return stored
+        raise RuntimeError(f"无法读取索引 {path}")
+    
+    def _block_sizes(self) -> Tuple[int, int]:
+        """由内存预算确定分块大小：(每块文本字节数, 每块非零元数)"""
+        return (max(1, self.memory_budget // TEXT_BLOCK_OVERHEAD),
+                max(1, self.memory_budget // NNZ_BLOCK_OVERHEAD))
     
     def load_stopwords(self) -> set:
         """加载中文停用词库"""
@@ -150,237 +481,634 @@ class RedMansionRAG:
     
     def chinese_tokenizer(self, text):
         """中文分词器（带停用词过滤）"""
-        # 使用jieba进行分词
-        words = list(jieba.cut(text))
+        return tokenize(text, self.stopwords, self.jieba_hmm)
+    
+    def _make_vectorizer(self, vocabulary: Dict[str, int] = None, idf: np.ndarray = None) -> TfidfVectorizer:
+        """创建与索引参数一致的TF-IDF向量化器，给定词表和IDF时可直接用于向量化查询"""
+        vectorizer = TfidfVectorizer(
+            tokenizer=self.chinese_tokenizer,
+            token_pattern=None,
+            lowercase=False,
+            ngram_range=self.ngram_range,
+            vocabulary=vocabulary,
+            dtype=np.float32
+        )
+        if idf is not None:
+            # 设置 idf_ 会通过属性设置器配置内部的 TfidfTransformer，使其处于已拟合状态
+            vectorizer.idf_ = idf
+        return vectorizer
+    
+    def build_term_counts(self) -> Tuple[sp.csr_matrix, List[str], np.ndarray, np.ndarray]:
+        """统计文档块词频
         
-        # 过滤停用词、标点符号和空白字符
-        filtered_words = []
-        punctuation = '，。！？；：""（）【】《》、'
+        保存未经特征筛选的全量词频矩阵及各词项的文档频率与总词频。
         
-        for word in words:
-            word = word.strip()
-            if (word and 
-                len(word) > 1 and  # 过滤单字符（除了一些有意义的单字）
-                word not in self.stopwords and 
-                not word.isspace() and 
-                not all(char in punctuation for char in word)):
-                filtered_words.append(word)
+        Returns:
+            (文档块×词项的词频矩阵（内存映射）, 词项列表, 文档频率, 总词频)
+        """
+        counts_store = store_path(self.cache_dir, "counts", self.counts_fingerprint)
+        stored = read_store(counts_store, "counts")
+        if stored is not None:
+            print("发现词频缓存，正在加载...")
+        else:
+            stored = self._build_store(counts_store, "counts", self._write_term_counts)
         
-        return filtered_words
+        arrays, manifest = stored
+        counts = csr_from_arrays(arrays['count_data'], arrays['count_indices'], arrays['count_indptr'],
+                                 tuple(manifest['shape']))
+        terms = StringTable(arrays['term_blob'], arrays['term_offsets']).tolist()
+        return counts, terms, arrays['df'], arrays['tf']
+    
+    def _write_term_counts(self, counts_store: Path) -> None:
+        """统计词频并写入词频索引
+        
+        按文档块顺序分块统计，每块统计完即写入磁盘，内存占用受 memory_budget_mb 限制
+        （词表本身除外，其大小取决于不同词项数而非语料规模）。
+        已有配置相同的词频索引时只对新增或修改文件的文档块分词，其余文件的词频行直接复制。
+        """
+        base = self._find_base_store("counts")
+        if base:
+            arrays, manifest = base
+            base_counts = csr_from_arrays(arrays['count_data'], arrays['count_indices'], arrays['count_indptr'],
+                                          tuple(manifest['shape']))
+            terms = StringTable(arrays['term_blob'], arrays['term_offsets']).tolist()
+            base_files = {(f['name'], f['sha256']): f for f in manifest['files']}
+        else:
+            base_counts, terms, base_files = None, [], {}
+        
+        if self.token_cache is None or self.token_cache.config != self.stage_configs['tokens']:
+            self.token_cache = TokenCache(self.cache_dir / "tokens.sqlite", self.stage_configs['tokens'])
+        hits, misses = self.token_cache.hits, self.token_cache.misses
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        text_block, nnz_block = self._block_sizes()
+        
+        # 是否启动进程池取决于整个构建需要统计的文档块数：内存预算较小时每块只有少量文档块，
+        # 按块判断会使并行分词永远不启动；进程池在各块之间复用
+        to_count = sum(f['end'] - f['start'] for f in self.chunk_files if (f['name'], f['sha256']) not in base_files)
+        pool = None
+        if self.n_jobs > 1:
+            if to_count >= PARALLEL_MIN_CHUNKS:
+                print(f"使用 {self.n_jobs} 个进程分词并统计词频...")
+                pool = ProcessPoolExecutor(max_workers=self.n_jobs, initializer=init_worker,
+                                           initargs=(self.stopwords, self.jieba_hmm, jieba.dt.dictionary))
+            else:
+                print(f"需要统计词频的文档块只有 {to_count} 个（少于 {PARALLEL_MIN_CHUNKS} 个），不启动进程池")
+        
+        writer = StoreWriter(counts_store, "counts")
+        counts_writer = CountsWriter(writer)
+        pending, pending_bytes, tokenized = [], 0, 0
+        
+        def flush():
+            nonlocal pending_bytes
+            counts = self._count_chunks([self.doc_chunks.texts[i] for i in pending], vocabulary, pool)
+            counts_writer.append(counts, len(vocabulary))
+            pending.clear()
+            pending_bytes = 0
+        
+        try:
+            for f in self.chunk_files:
+                record = base_files.get((f['name'], f['sha256']))
+                if record is not None:
+                    # 文件未变化，分块复制已有词频行
+                    if pending:
+                        flush()
+                    rows = csr_rows(base_counts, record['start'], record['end'])
+                    for start, end in row_blocks(rows.indptr, nnz_block):
+                        counts_writer.append(csr_rows(rows, start, end), len(vocabulary))
+                else:
+                    for i in range(f['start'], f['end']):
+                        pending.append(i)
+                        pending_bytes += self.doc_chunks.texts.nbytes(i)
+                        tokenized += 1
+                        if pending_bytes >= text_block:
+                            flush()
+            if pending:
+                flush()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        # 移除已不再出现的词项
+        alive = counts_writer.compact(nnz_block)
+        terms = [term for term, keep in zip(vocabulary, alive) if keep]
+        
+        if base:
+            print(f"增量更新：复用 {counts_writer.n_rows - tokenized} 个文档块的词频，重新统计 {tokenized} 个文档块")
+        print(f"分词缓存：命中 {self.token_cache.hits - hits} 个文档块，"
+              f"重新分词 {self.token_cache.misses - misses} 个文档块")
+        
+        term_table = StringTable.from_strings(terms)
+        writer.save('term_blob', term_table.blob)
+        writer.save('term_offsets', term_table.offsets)
+        writer.save('df', counts_writer.df)
+        writer.save('tf', counts_writer.tf)
+        writer.commit({
+            'fingerprint': self.counts_fingerprint,
+            'config': self.stage_configs['counts'],
+            'files': self.chunk_files,
+            'shape': [counts_writer.n_rows, len(terms)],
+        })
+    
+    def _count_chunks(self, texts: List[str], vocabulary: Dict[str, int],
+                      pool: Optional[ProcessPoolExecutor] = None) -> sp.csr_matrix:
+        """统计文档块词频，分词结果优先取自分词缓存
+        
+        给定进程池时将文档块分批交给进程池分词并统计，主进程按批次顺序合并词表，
+        词表顺序与词频矩阵均与串行统计相同。
+        
+        Args:
+            texts: 文档块文本列表
+            vocabulary: 词项到列号的映射，新出现的词项追加到末尾（原地修改）
+            pool: 以 init_worker 初始化的进程池，为None时串行分词
+        """
+        token_lists = self.token_cache.lookup(texts)
+        missing = [i for i, tokens in enumerate(token_lists) if tokens is None]
+        
+        if pool is None or not missing:
+            for i in missing:
+                token_lists[i] = self.chinese_tokenizer(texts[i])
+            self.token_cache.store((texts[i] for i in missing), (token_lists[i] for i in missing))
+            counts = count_terms(token_lists, partial(word_ngrams, ngram_range=self.ngram_range), vocabulary)
+            return with_columns(counts, len(vocabulary))
+        
+        # 每个进程约分到4批，便于负载均衡
+        shard_size = -(-len(texts) // (self.n_jobs * 4))
+        shards = [[texts[i] if token_lists[i] is None else token_lists[i]
+                   for i in range(start, min(start + shard_size, len(texts)))]
+                  for start in range(0, len(texts), shard_size)]
+        
+        pieces = []
+        results = pool.map(count_shard, shards, [self.ngram_range] * len(shards))
+        for start, (tokenized, shard_terms, shard_counts) in zip(range(0, len(texts), shard_size), results):
+            for i, tokens in tokenized.items():
+                token_lists[start + i] = tokens
+            pieces.append(merge_shard(shard_counts, shard_terms, vocabulary))
+        self.token_cache.store((texts[i] for i in missing), (token_lists[i] for i in missing))
+        return sp.vstack([with_columns(piece, len(vocabulary)) for piece in pieces], format='csr')
     
     def build_vector_index(self) -> None:
         """构建向量索引"""
         print("正在构建向量索引...")
+        if self.vectors_fingerprint is None:
+            self.compute_fingerprints()
+        vectors_store = store_path(self.cache_dir, "vectors", self.vectors_fingerprint)
         
         # 检查缓存
-        if self.vectors_cache.exists():
+        stored = read_store(vectors_store, "vectors")
+        if stored is not None:
             print("发现向量缓存，正在加载...")
-            with open(self.vectors_cache, 'rb') as f:
-                cache_data = pickle.load(f)
-                self.vectorizer = TfidfVectorizer(
-                    tokenizer=self.chinese_tokenizer,
-                    vocabulary=cache_data['vocabulary']
-                )
-                self.vectorizer.idf_ = cache_data['idf'] # 设置idf_
-                # TfidfVectorizer 的 _tfidf (TfidfTransformer) 也需要被正确配置
-                # 设置 idf_ 应该会通过属性设置器处理内部的 TfidfTransformer
-                # 同时，确保 TfidfVectorizer 内部的 _tfidf 对象也认为自己是 fitted
-                # 通常，TfidfTransformer 检查 _idf_diag 是否存在。设置 idf_ 会间接处理这个。
-
-                self.doc_vectors = cache_data['vectors']
-            print("向量索引加载完成")
-            return
+        else:
+            stored = self._build_store(vectors_store, "vectors", self._write_vector_index)
         
-        # 提取文档块内容
-        texts = [chunk['content'] for chunk in self.doc_chunks]
+        arrays, manifest = stored
+        vocabulary = {term: i for i, term in enumerate(StringTable(arrays['vocab_blob'], arrays['vocab_offsets']))}
+        self.vectorizer = self._make_vectorizer(vocabulary, np.asarray(arrays['idf']))
         
-        # 创建TF-IDF向量化器
-        self.vectorizer = TfidfVectorizer(
-            tokenizer=self.chinese_tokenizer,
-            lowercase=False,
-            max_features=5000,
-            ngram_range=(1, 2),
-            min_df=1,
-            max_df=0.95
-        )
+        # 向量矩阵与倒排表直接使用内存映射数组，无需复制
+        self.doc_vectors = csr_from_arrays(arrays['vectors_data'], arrays['vectors_indices'],
+                                           arrays['vectors_indptr'], tuple(manifest['shape']))
+        self.inverted_index = InvertedIndex.from_arrays(arrays, n_docs=manifest['shape'][0])
+        print("向量索引加载完成")
+    
+    def _write_vector_index(self, vectors_store: Path) -> None:
+        """由词频矩阵筛选特征并计算TF-IDF（与 TfidfVectorizer 的结果一致），无需重新分词
+        
+        按行分块计算TF-IDF向量并写入磁盘，倒排表同样分块构建，内存占用受 memory_budget_mb 限制。
+        """
+        counts, terms, df, tf = self.build_term_counts()
+        n_chunks = counts.shape[0]
+        columns = select_features(terms, df, tf, n_chunks, self.max_features, self.min_df, self.max_df)
+        idf = smooth_idf(df[columns], n_chunks)
+        _, nnz_block = self._block_sizes()
         
-        # 构建向量
-        self.doc_vectors = self.vectorizer.fit_transform(texts)
+        writer = StoreWriter(vectors_store, "vectors")
+        index_dtype = np.int32 if counts.nnz <= np.iinfo(np.int32).max else np.int64
+        writer.append('vectors_indptr', [0], dtype=index_dtype)
+        writer.append('vectors_data', np.empty(0, dtype=np.float32))
+        writer.append('vectors_indices', np.empty(0, dtype=np.int32))
+        nnz = 0
+        for start, end in row_blocks(counts.indptr, nnz_block):
+            block = tfidf_rows(csr_rows(counts, start, end), columns, idf)
+            writer.append('vectors_data', block.data)
+            writer.append('vectors_indices', block.indices)
+            writer.append('vectors_indptr', block.indptr[1:] + nnz)
+            nnz += block.nnz
         
-        # 保存缓存 - 保存词汇表、向量和idf_
-        cache_data = {
-            'vocabulary': self.vectorizer.vocabulary_,
-            'vectors': self.doc_vectors,
-            'idf': self.vectorizer.idf_  # 保存idf_
-        }
-        with open(self.vectors_cache, 'wb') as f:
-            pickle.dump(cache_data, f)
+        # 由刚写入的向量分块构建倒排表
+        doc_vectors = csr_from_arrays(writer.appended('vectors_data'), writer.appended('vectors_indices'),
+                                      writer.appended('vectors_indptr'), (n_chunks, len(columns)))
+        write_postings(writer, doc_vectors, nnz_block)
+        del doc_vectors
+        
+        # 保存词汇表（按列顺序）与IDF
+        vocab = StringTable.from_strings(terms[c] for c in columns)
+        writer.save('idf', idf)
+        writer.save('vocab_blob', vocab.blob)
+        writer.save('vocab_offsets', vocab.offsets)
+        writer.commit({
+            'fingerprint': self.vectors_fingerprint,
+            'counts_fingerprint': self.counts_fingerprint,
+            'n_chunks': n_chunks,
+            'shape': [n_chunks, len(columns)],
+            'nnz': nnz
+        })
         
         print("向量索引构建完成")
     
-    def search_relevant_chunks(self, query: str, top_k: int = 10, similarity_threshold: float = 0.01) -> List[Dict]:
+    def build_bm25_index(self) -> None:
+        """构建BM25索引
+        
+        BM25权重由词频索引（全量词表，与TF-IDF使用相同的分词与N-gram）直接计算，无需重新分词。
+        """
+        if self.bm25_fingerprint is None:
+            self.compute_fingerprints()
+        bm25_store = store_path(self.cache_dir, "bm25", self.bm25_fingerprint)
+        
+        stored = read_store(bm25_store, "bm25")
+        if stored is None:
+            print("正在构建BM25索引...")
+            stored = self._build_store(bm25_store, "bm25", self._write_bm25_index)
+            print("BM25索引构建完成")
+        self.bm25 = BM25Index.from_arrays(*stored)
+    
+    def _write_bm25_index(self, bm25_store: Path) -> None:
+        """由词频索引计算BM25权重并写入BM25索引"""
+        counts, terms, df, tf = self.build_term_counts()
+        writer = StoreWriter(bm25_store, "bm25")
+        meta = BM25Index.write(writer, counts, terms, df, tf, self.bm25_k1, self.bm25_b, self._block_sizes()[1])
+        meta.update({'fingerprint': self.bm25_fingerprint, 'counts_fingerprint': self.counts_fingerprint})
+        writer.commit(meta)
+    
+    def build_dense_index(self) -> None:
+        """构建稠密检索（LSA）索引
+        
+        对TF-IDF矩阵做截断SVD得到低维文档块向量，并建立IVF近似最近邻索引；
+        构建时测量近似检索相对精确检索的Recall@k，选择满足目标召回率的最少探查簇数。
+        """
+        if self.doc_vectors is None:
+            self.build_vector_index()
+        dense_store = store_path(self.cache_dir, "dense", self.dense_fingerprint)
+        
+        stored = read_store(dense_store, "dense")
+        if stored is None:
+            print("正在构建稠密检索索引...")
+            stored = self._build_store(dense_store, "dense", self._write_dense_index)
+            print("稠密检索索引构建完成")
+        
+        manifest = stored[1]
+        recalls = ", ".join(f"nprobe={n}: {r:.3f}" for n, r in manifest['recalls'].items())
+        print(f"稠密检索: {manifest['shape'][1]}维 {manifest['dtype']}，{manifest['n_lists']}个簇，"
+              f"探查{manifest['nprobe']}个簇（Recall@{manifest['recall_k']}: {recalls}）")
+        if manifest['exact_ratio'] >= 1.0:
+            print(f"注意：目标召回率 {manifest['target_recall']} 需要探查过多的簇，稠密检索已回退为精确检索")
+        else:
+            print(f"平均每次查询计算 {manifest['scan_ratio']:.1%} 的文档块向量"
+                  f"（{manifest['exact_ratio']:.1%} 的查询回退为精确检索）")
+        self.dense = DenseIndex.from_arrays(*stored)
+    
+    def _write_dense_index(self, dense_store: Path) -> None:
+        """对TF-IDF矩阵做截断SVD并写入稠密检索索引"""
+        writer = StoreWriter(dense_store, "dense")
+        meta = DenseIndex.write(writer, self.doc_vectors, self.dense_dim, self.dense_dtype,
+                                self.dense_target_recall, self.dense_recall_k, max_nnz=self._block_sizes()[1])
+        meta.update({'fingerprint': self.dense_fingerprint, 'vectors_fingerprint': self.vectors_fingerprint})
+        writer.commit(meta)
+    
+    def _bm25_query_vectors(self, queries: List[str]) -> sp.csr_matrix:
+        """将查询转换为BM25查询向量（各词项在查询中的出现次数）"""
+        return sp.vstack([self.bm25.query_vector(word_ngrams(self.chinese_tokenizer(query), self.ngram_range))
+                          for query in queries], format='csr')
+    
+    def _scoring_index(self, scoring: Optional[str]) -> Tuple[Callable[[List[str]], sp.csr_matrix], sp.csr_matrix,
+                                                             InvertedIndex]:
+        """返回评分方式对应的 (查询向量化函数, 文档块×词项权重矩阵, 倒排索引)
+        
+        两种评分方式的文档块得分均为查询向量与权重矩阵对应行的内积：
+        TF-IDF的权重与查询向量已L2归一化，内积即余弦相似度；BM25的权重已计入IDF与文档长度归一化。
+        """
+        scoring = scoring or self.scoring
+        if scoring == "bm25":
+            if self.bm25 is None:
+                with self._build_lock:
+                    if self.bm25 is None:
+                        self.build_bm25_index()
+            return self._bm25_query_vectors, self.bm25.doc_weights, self.bm25.inverted_index
+        if scoring != "tfidf":
+            raise ValueError(f"不支持的评分方式: {scoring}")
+        if self.vectorizer is None or self.inverted_index is None:
+            raise ValueError("向量索引未构建，请先调用 build_vector_index()")
+        return self.vectorizer.transform, self.doc_vectors, self.inverted_index
+    
+    def _ensure_dense_index(self) -> None:
+        """稠密检索索引尚未加载时构建（或加载）"""
+        if self.dense is None:
+            with self._build_lock:
+                if self.dense is None:
+                    self.build_dense_index()
+    
+    def _dense_search(self, queries: List[str], top_k: int, similarity_threshold: float,
+                      query_vectors: Optional[sp.csr_matrix] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """稠密检索：TF-IDF查询向量投影到LSA空间后做近似最近邻检索，返回每个查询的 (文档块编号, 相似度)
+        
+        query_vectors 为已计算的TF-IDF查询向量（可省略）。
+        """
+        if self.vectorizer is None:
+            raise ValueError("向量索引未构建，请先调用 build_vector_index()")
+        self._ensure_dense_index()
+        if query_vectors is None:
+            query_vectors = self.vectorizer.transform(queries)
+        projected = self.dense.project(query_vectors)
+        return [self.dense.search_projected(query, top_k, similarity_threshold) for query in projected]
+    
+    def search_relevant_chunks(self, query: str, top_k: int = 10, similarity_threshold: float = 0.01,
+                               scoring: Optional[str] = None, mmr_lambda: Optional[float] = _UNSET,
+                               cutoff: Optional[str] = _UNSET) -> List[ChunkView]:
         """搜索相关文档块
         
         Args:
             query: 查询文本
             top_k: 最大返回文档块数量
-            similarity_threshold: 相似度阈值，只返回相似度高于此值的结果
+            similarity_threshold: 相似度阈值，只返回相似度高于此值的结果（BM25时为BM25得分的阈值，
+                混合检索时用于各检索器自身的得分，结果中的相似度为融合得分）
+            scoring: 评分方式（"tfidf"、"bm25"、"dense" 或 "hybrid"），默认使用实例的 scoring
+            mmr_lambda: 多样性重排的相关度权重（0~1，越小越偏重多样性），默认使用实例的 mmr_lambda，传入None时本次不重排；
+                启用时先取回 max(top_k, MMR_CANDIDATES) 个候选，再按最大边际相关选出top_k个，
+                结果按选择的先后排列，相似度仍为检索得分
+            cutoff: 自适应截断方式（"knee" 或 "drop"），默认使用实例的 cutoff，传入None时本次不截断；
+                启用时根据前top_k个得分的曲线确定返回的数量（cutoff_min_k ~ top_k），只返回明显更相关的文档块
+        
+        查询先经 normalize_query 规范化；相同的查询与参数在 query_cache 中命中时直接返回缓存的结果，
+        索引指纹变化（重新构建索引）后缓存自动失效。
         """
-        if self.vectorizer is None or self.doc_vectors is None:
-            raise ValueError("向量索引未构建，请先调用 build_vector_index()")
+        query = normalize_query(query)
+        scoring = scoring or self.scoring
+        mmr_lambda = self.mmr_lambda if mmr_lambda is _UNSET else mmr_lambda
+        cutoff = self.cutoff if cutoff is _UNSET else cutoff
+        cache = self.query_cache
+        if cache is None:
+            return self._build_results(*self._search_selected(query, top_k, similarity_threshold, scoring,
+                                                              mmr_lambda, cutoff))
+        
+        cache.validate((self.vectors_fingerprint, self.bm25_fingerprint, self.dense_fingerprint))
+        key = (query, top_k, similarity_threshold, scoring, mmr_lambda, cutoff)
+        if cutoff is not None:
+            key += (self.cutoff_min_k, self.cutoff_drop_ratio)
+        if scoring == "hybrid":
+            key += (tuple(self.hybrid_retrievers), self.fusion,
+                    None if self.fusion_weights is None else tuple(self.fusion_weights), self.rrf_k)
+        cached = cache.get(key)
+        if cached is None:
+            cached = self._search_selected(query, top_k, similarity_threshold, scoring, mmr_lambda, cutoff)
+            cache.put(key, cached)
+        return self._build_results(*cached)
+    
+    def _search_selected(self, query: str, top_k: int, similarity_threshold: float, scoring: str,
+                         mmr_lambda: Optional[float], cutoff: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """检索后按自适应截断确定返回的数量，再按最大边际相关重排（两者均未启用时直接返回检索结果）
+        
+        截断只看按得分排列的前top_k个结果；候选文档块之间的相似度使用TF-IDF向量（各评分方式共用，已L2归一化）计算。
+        """
+        if mmr_lambda is None and cutoff is None:
+            return self._search_indices(query, top_k, similarity_threshold, scoring)
+        n_candidates = top_k if mmr_lambda is None else max(top_k, MMR_CANDIDATES)
+        indices, scores = self._search_indices(query, n_candidates, similarity_threshold, scoring)
+        k = min(top_k, len(indices))
+        if cutoff is not None:
+            k = adaptive_k(scores[:top_k], cutoff, self.cutoff_min_k, top_k, self.cutoff_drop_ratio)
+        if mmr_lambda is None or len(indices) <= 1:
+            return indices[:k], scores[:k]
+        selected = maximal_marginal_relevance(scores, self.doc_vectors[indices], k, mmr_lambda)
+        return indices[selected], scores[selected]
+    
+    def _search_indices(self, query: str, top_k: int, similarity_threshold: float, scoring: Optional[str],
+                        tfidf_vector: Optional[sp.csr_matrix] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """检索单个查询，返回按得分从高到低排列的 (文档块编号, 得分)
+        
+        tfidf_vector 为已计算的TF-IDF查询向量，TF-IDF与稠密检索可共用，避免重复分词。
+        """
+        scoring = scoring or self.scoring
+        if scoring == "dense":
+            return self._dense_search([query], top_k, similarity_threshold, tfidf_vector)[0]
+        if scoring == "hybrid":
+            return self._hybrid_search(query, top_k, similarity_threshold)
+        
+        vectorize, doc_matrix, index = self._scoring_index(scoring)
         
         # 向量化查询
-        query_vector = self.vectorizer.transform([query])
+        query_vector = tfidf_vector if scoring == "tfidf" and tfidf_vector is not None else vectorize([query])
+        
+        engine = self.search_engine
+        if engine == "auto":
+            cost = index.postings_cost(query_vector)
+            engine = "inverted" if cost * INVERTED_INDEX_COST_RATIO < doc_matrix.nnz else "matrix"
+        
+        if engine == "inverted":
+            # 只对包含查询词项的文档块打分
+            return index.search(query_vector, top_k=top_k, similarity_threshold=similarity_threshold)
+        # 一次稀疏矩阵乘法（doc_matrix @ q.T）得到全部得分，再用argpartition取top_k
+        scores = doc_matrix @ query_vector.toarray().ravel()
+        return select_top_k(scores, top_k, similarity_threshold)
+    
+    def _prepare_retrievers(self, retrievers) -> None:
+        """确保各检索器的索引已构建（在提交到线程池之前完成，避免多个线程同时构建同一索引）"""
+        for name in retrievers:
+            if name not in SCORING_METHODS or name == "hybrid":
+                raise ValueError(f"不支持的混合检索器: {name}")
+            if name == "dense":
+                self._ensure_dense_index()
+            else:
+                self._scoring_index(name)
+    
+    def _hybrid_search(self, query: str, top_k: int, similarity_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """混合检索：在线程池中并发执行各检索器，再按 fusion 融合排序
+        
+        NumPy/SciPy的矩阵运算执行期间释放GIL，各检索器的打分可以并行，总耗时接近最慢的检索器。
+        分词持有GIL无法并行，TF-IDF与稠密检索共用同一个TF-IDF查询向量，只分词一次。
+        每个检索器取回 max(top_k, HYBRID_CANDIDATES) 个候选，使融合后的前top_k个结果足够稳定。
+        """
+        if self.fusion not in FUSION_METHODS:
+            raise ValueError(f"不支持的融合方式: {self.fusion}")
+        retrievers = tuple(self.hybrid_retrievers)
+        self._prepare_retrievers(retrievers)
+        if self._retrieval_pool is None:
+            # 第一个检索器在当前线程执行，其余检索器（至多两个）提交到线程池
+            self._retrieval_pool = ThreadPoolExecutor(max_workers=len(SCORING_METHODS) - 2,
+                                                      thread_name_prefix="retriever")
+        n_candidates = max(top_k, HYBRID_CANDIDATES)
+        tfidf_vector = None
+        if "tfidf" in retrievers and "dense" in retrievers:
+            tfidf_vector = self.vectorizer.transform([query])
+        futures = [self._retrieval_pool.submit(self._search_indices, query, n_candidates, similarity_threshold, name,
+                                               tfidf_vector)
+                   for name in retrievers[1:]]
+        rankings = [self._search_indices(query, n_candidates, similarity_threshold, retrievers[0], tfidf_vector)]
+        rankings.extend(future.result() for future in futures)
+        if self.fusion == "rrf":
+            indices, scores = reciprocal_rank_fusion(rankings, self.fusion_weights, self.rrf_k)
+        else:
+            indices, scores = weighted_score_fusion(rankings, self.fusion_weights)
+        return indices[:top_k], scores[:top_k]
+    
+    def _build_results(self, indices, similarities) -> List[ChunkView]:
+        """根据文档块编号和相似度构建检索结果（只读视图，用法与字典相同，内容按需解码）"""
+        return [ChunkView(self.doc_chunks, idx, float(similarity))
+                for idx, similarity in zip(indices, similarities)]
+    
+    def search_many(self, queries: List[str], top_k: int = 10, similarity_threshold: float = 0.01,
+                    as_dicts: bool = False, batch_size: int = 256, scoring: Optional[str] = None):
+        """批量搜索相关文档块
         
-        # 计算相似度
-        similarities = cosine_similarity(query_vector, self.doc_vectors).flatten()
+        所有查询一次性向量化，每批查询与倒排表做一次稀疏矩阵乘法得到全部得分。
         
-        # 获取所有相似度高于阈值的文档块
-        valid_indices = np.where(similarities > similarity_threshold)[0]
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询最大返回文档块数量
+            similarity_threshold: 相似度阈值，只返回相似度高于此值的结果
+            as_dicts: 为True时返回与 search_relevant_chunks 相同结构的结果列表
+            batch_size: 每批相乘的查询数量，用于限制得分矩阵的内存占用
+            scoring: 评分方式（"tfidf"、"bm25"、"dense" 或 "hybrid"），默认使用实例的 scoring
         
-        # 按相似度排序
-        sorted_indices = valid_indices[np.argsort(similarities[valid_indices])[::-1]]
+        Returns:
+            默认返回 (indices, scores)：形状为 (查询数, top_k) 的文档块编号（int32，不足处为-1）
+            与相似度（float32，不足处为0）数组，每行按相似度从高到低排列；
+            as_dicts为True时返回每个查询的结果列表
+        """
+        top_k = max(top_k, 0)
+        indices = np.full((len(queries), top_k), -1, dtype=np.int32)
+        scores = np.zeros((len(queries), top_k), dtype=np.float32)
+        if not queries:
+            return [] if as_dicts else (indices, scores)
         
-        # 限制返回数量
-        top_indices = sorted_indices[:top_k]
+        scoring = scoring or self.scoring
+        if scoring in ("dense", "hybrid"):
+            if scoring == "dense":
+                rows = self._dense_search(queries, top_k, similarity_threshold)
+            else:
+                rows = (self._hybrid_search(query, top_k, similarity_threshold) for query in queries)
+            for row, (row_indices, row_scores) in enumerate(rows):
+                indices[row, :len(row_indices)] = row_indices
+                scores[row, :len(row_scores)] = row_scores
+            if as_dicts:
+                return [self._build_results(row_indices[row_indices >= 0], row_scores[row_indices >= 0])
+                        for row_indices, row_scores in zip(indices, scores)]
+            return indices, scores
         
-        results = []
-        for idx in top_indices:
-            chunk = self.doc_chunks[idx].copy()
-            chunk['similarity'] = float(similarities[idx])
-            results.append(chunk)
+        vectorize, _, index = self._scoring_index(scoring)
+        query_vectors = vectorize(queries)
+        term_matrix = index.term_matrix()
         
-        return results
+        for start in range(0, len(queries), batch_size):
+            # 查询×文档块的稀疏得分矩阵，只包含与查询有共同词项的文档块
+            batch_scores = (query_vectors[start:start + batch_size] @ term_matrix).tocsr()
+            # 按文档块编号排列候选，得分相同时与 search_relevant_chunks 的顺序一致
+            batch_scores.sort_indices()
+            for row in range(batch_scores.shape[0]):
+                row_start, row_end = batch_scores.indptr[row], batch_scores.indptr[row + 1]
+                row_indices, row_scores = select_top_k(
+                    batch_scores.data[row_start:row_end], top_k, similarity_threshold,
+                    candidates=batch_scores.indices[row_start:row_end]
+                )
+                indices[start + row, :len(row_indices)] = row_indices
+                scores[start + row, :len(row_scores)] = row_scores
+        
+        if as_dicts:
+            return [self._build_results(row_indices[row_indices >= 0], row_scores[row_indices >= 0])
+                    for row_indices, row_scores in zip(indices, scores)]
+        return indices, scores
     
-    def generate_answer(self, query: str, context_chunks: List[Dict]) -> str:
-        """使用DeepSeek API生成答案"""
-        # 构建上下文
-        context = "\n\n".join([f"文档片段{i+1}：{chunk['content']}" 
-                              for i, chunk in enumerate(context_chunks)])
-        # 我测试了多个版本。可以换一下提示词对比哪个效果好，目前这个我觉得比较好
-        system_prompt = """
-# Role: 红楼梦研究专家
-
-## Profile
-- language: 中文
-- description: 精通《红楼梦》文本及红学研究，能够深入解析作品的人物、情节、诗词及文化内涵
-- background: 多年从事《红楼梦》研究与教学，参与过多项红学课题研究
-- personality: 严谨细致，富有文人气质，善于引经据典
-- expertise: 文本分析、人物研究、诗词鉴赏、文化解读
-- target_audience: 红学爱好者、文学研究者、学生群体
-
-## Skills
-
-1. 文本解析能力
-   - 情节梳理: 能准确还原小说情节脉络
-   - 细节把握: 对文本细节有敏锐洞察力
-   - 人物分析: 深入剖析人物性格与命运
-   - 诗词解读: 精准解析书中诗词内涵
-
-2. 学术研究能力
-   - 文献考证: 熟悉各类红学研究成果
-   - 文化阐释: 揭示作品背后的文化内涵
-   - 比较研究: 能与其他文学作品进行对比
-   - 版本鉴别: 了解不同版本差异
-
-## Rules
-
-1. 回答原则：
-   - 基于文本: 所有回答必须严格依据原著文本
-   - 严谨准确: 不妄加猜测，不传播未经考证的观点
-   - 深度解析: 透过表面现象揭示深层含义
-   - 客观公正: 避免个人主观臆断
-
-2. 行为准则：
-   - 引经据典: 重要观点需引用原文佐证
-   - 语言典雅: 保持与原著相称的文雅风格
-   - 层次分明: 回答要有逻辑性和条理性
-   - 深入浅出: 复杂问题要解释得通俗易懂
-
-3. 限制条件：
-   - 不涉争议: 避免介入红学争议性话题
-   - 不妄评续作: 对后四十回保持审慎态度
-   - 不越文本: 不脱离文本过度解读
-   - 不代作者: 不以作者口吻发表观点
-
-## Workflows
-
-- 目标: 提供专业准确的红楼梦解读
-- 步骤 1: 仔细理解用户问题，明确询问重点
-- 步骤 2: 检索相关文本段落，确认信息准确性
-- 步骤 3: 组织回答内容，适当引用原文
-- 步骤 4: 以典雅文风呈现完整解答
-- 预期结果: 用户获得权威、深入的红楼梦知识
-
-## Initialization
-作为红楼梦研究专家，你必须遵守上述Rules，按照Workflows执行任务。
-        """.strip()
+    def generate_answer(self, query: str, context_chunks: List[Dict], use_cache: bool = True) -> str:
+        """使用DeepSeek API生成答案
         
-        user_prompt = f"""
-基于以下文档内容回答问题：
-
-{context}
-
-问题：{query}
-        """.strip()
+        问题（规范化后）、文档块、模型、提示词版本与温度都相同时，直接返回 answer_cache 中的答案；
+        出错时返回的错误信息不写入缓存。
+        
+        Args:
+            query: 用户问题
+            context_chunks: 检索到的文档块
+            use_cache: 为False时不读取答案缓存（生成的答案仍会写入缓存）
+        """
+        return self._generate_answer(query, context_chunks, use_cache)[0]
+    
+    def _generate_answer(self, query: str, context_chunks: List[Dict], use_cache: bool = True) -> Tuple[str, bool]:
+        """生成答案，返回 (答案或错误信息, 是否成功)"""
+        cache_key, cached = self._cached_answer(query, context_chunks, use_cache)
+        if cached is not None:
+            return cached, True
         
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000,
-                stream=False
-            )
+            response = self.client.chat.completions.create(**self._completion_params(query, context_chunks, stream=False))
+            self.prompt_cache_stats.record(getattr(response, 'usage', None))
             
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
+            if cache_key is not None and answer:
+                self.answer_cache.put(cache_key, query, answer, self.model)
+            return answer, bool(answer)
             
         except Exception as e:
-            error_type = type(e).__name__
-            error_details = str(e) if str(e) else "未知错误"
-            print(f"生成答案时出错: {error_type}: {error_details}")
-            
-            # 确保返回有效的错误信息字符串
-            return f"生成答案时出错: {error_type} - {error_details}"
+            return self._answer_error(e), False
+    
+    def _cached_answer(self, query: str, context_chunks: List[Dict], use_cache: bool) -> Tuple[Optional[bytes], Optional[str]]:
+        """查询答案缓存，返回 (缓存键, 缓存的答案)；未启用答案缓存时缓存键为None"""
+        if self.answer_cache is None:
+            return None, None
+        cache_key = answer_key(normalize_query(query), context_digest(context_order(context_chunks)),
+                               self.model, PROMPT_VERSION, self.temperature)
+        cached = self.answer_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            print("答案缓存命中")
+        return cache_key, cached
+    
+    @staticmethod
+    def _answer_error(e: Exception) -> str:
+        """生成答案出错时返回给用户的错误信息"""
+        error_type = type(e).__name__
+        error_details = str(e) if str(e) else "未知错误"
+        print(f"生成答案时出错: {error_type}: {error_details}")
+        
+        # 确保返回有效的错误信息字符串
+        return f"生成答案时出错: {error_type} - {error_details}"
     
-    def ask(self, question: str, top_k: int = 10, similarity_threshold: float = 0.01) -> Dict:
+    def ask(self, question: str, top_k: int = 10, similarity_threshold: float = 0.01,
+            scoring: Optional[str] = None, use_cache: bool = True, mmr_lambda: Optional[float] = _UNSET,
+            cutoff: Optional[str] = _UNSET) -> Dict:
         """问答接口
         
+        检索后先查找语义答案缓存：已回答过的问题与本问题的TF-IDF向量足够相似、且检索到的文档块足够重合时，
+        直接返回已有的答案与来源。
+        
         Args:
             question: 用户问题
             top_k: 最大返回文档块数量，默认10
             similarity_threshold: 相似度阈值，默认0.01
+            scoring: 评分方式，默认使用实例的 scoring（"hybrid"为混合检索）
+            use_cache: 为False时本次请求跳过语义缓存与答案缓存，重新生成答案（新答案仍会写入缓存）
+            mmr_lambda: 多样性重排的相关度权重，默认使用实例的 mmr_lambda，传入None时本次不重排（见 search_relevant_chunks）
+            cutoff: 自适应截断方式（"knee" 或 "drop"），默认使用实例的 cutoff，传入None时本次不截断；启用后 top_k 为最大数量
         """
-        print(f"\n问题: {question}")
-        print("正在搜索相关内容...")
-        
-        # 搜索相关文档块
-        relevant_chunks = self.search_relevant_chunks(question, top_k=top_k, similarity_threshold=similarity_threshold)
+        relevant_chunks, cached, semantic_key = self._retrieve_for_answer(
+            question, top_k, similarity_threshold, scoring, use_cache, mmr_lambda, cutoff
+        )
         
         if not relevant_chunks:
             return {
                 'question': question,
-                'answer': '抱歉，在文档中没有找到与您问题相关的内容。',
+                'answer': NO_CONTEXT_ANSWER,
                 'sources': []
             }
-        
-        print(f"找到 {len(relevant_chunks)} 个相关文档片段")
+        if cached is not None:
+            return {
+                'question': question,
+                'answer': cached['answer'],
+                'sources': cached['sources']
+            }
         
         # 生成答案
         print("正在生成答案...")
-        answer = self.generate_answer(question, relevant_chunks)
+        answer, ok = self._generate_answer(question, relevant_chunks, use_cache)
         
-        # 整理来源信息
-        sources = []
-        for chunk in relevant_chunks:
-            sources.append({
-                'source': chunk['source'],
-                'similarity': chunk['similarity'],
-                'content_preview': chunk['content'][:100] + '...' if len(chunk['content']) > 100 else chunk['content']
-            })
+        sources = self._format_sources(relevant_chunks)
+        if ok:
+            self._remember_answer(question, semantic_key, answer, sources)
         
         return {
             'question': question,
@@ -388,16 +1116,359 @@ class RedMansionRAG:
             'sources': sources
         }
     
+    def ask_stream(self, question: str, top_k: int = 10, similarity_threshold: float = 0.01,
+                   scoring: Optional[str] = None, use_cache: bool = True,
+                   mmr_lambda: Optional[float] = _UNSET, cutoff: Optional[str] = _UNSET) -> Iterator[Dict]:
+        """流式问答接口
+        
+        先产出检索结果 {'type': 'sources', 'question': 问题, 'sources': 来源列表}，
+        再随大模型的输出逐段产出 {'type': 'delta', 'content': 答案片段}，
+        最后产出 {'type': 'done', 'answer': 完整答案}。来源与答案的结构与 ask 相同；
+        缓存命中或出错时，答案（或错误信息）作为一个片段产出。提前停止迭代时会关闭与API的连接。
+        
+        Args:
+            question: 用户问题
+            top_k: 最大返回文档块数量，默认10
+            similarity_threshold: 相似度阈值，默认0.01
+            scoring: 评分方式，默认使用实例的 scoring
+            use_cache: 为False时本次请求跳过语义缓存与答案缓存
+            mmr_lambda: 多样性重排的相关度权重，默认使用实例的 mmr_lambda，传入None时本次不重排
+            cutoff: 自适应截断方式，默认使用实例的 cutoff，传入None时本次不截断
+        """
+        prepared = self._prepare_answer(question, top_k, similarity_threshold, scoring, use_cache, mmr_lambda,
+                                        cutoff)
+        yield {'type': 'sources', 'question': question, 'sources': prepared['sources']}
+        if prepared['answer'] is not None:
+            yield {'type': 'delta', 'content': prepared['answer']}
+            yield {'type': 'done', 'answer': prepared['answer']}
+            return
+        
+        parts = []
+        try:
+            response = self.client.chat.completions.create(
+                **self._completion_params(question, prepared['chunks'], stream=True)
+            )
+            try:
+                for event in response:
+                    # 最后一个事件不含 choices，只有本次请求的 usage
+                    self.prompt_cache_stats.record(getattr(event, 'usage', None))
+                    delta = event.choices[0].delta.content if event.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield {'type': 'delta', 'content': delta}
+            finally:
+                response.close()
+        except Exception as e:
+            error = ("\n\n" if parts else "") + self._answer_error(e)
+            yield {'type': 'delta', 'content': error}
+            yield {'type': 'done', 'answer': "".join(parts) + error}
+            return
+        
+        answer = "".join(parts)
+        self._store_answer(question, prepared, answer)
+        yield {'type': 'done', 'answer': answer}
+    
+    def _prepare_answer(self, question: str, top_k: int, similarity_threshold: float, scoring: Optional[str],
+                        use_cache: bool, mmr_lambda: Optional[float] = _UNSET, cutoff: Optional[str] = _UNSET) -> Dict:
+        """生成答案之前的同步步骤：检索、查找语义答案缓存与答案缓存
+        
+        Returns:
+            {'sources': 来源列表, 'answer': 无检索结果或缓存命中时的答案（否则为None）,
+             'chunks': 检索到的文档块, 'cache_key': 答案缓存键, 'semantic_key': 写入语义缓存所需的信息}
+        """
+        relevant_chunks, cached, semantic_key = self._retrieve_for_answer(
+            question, top_k, similarity_threshold, scoring, use_cache, mmr_lambda, cutoff
+        )
+        prepared = {'chunks': relevant_chunks, 'cache_key': None, 'semantic_key': semantic_key}
+        if not relevant_chunks:
+            prepared.update(sources=[], answer=NO_CONTEXT_ANSWER)
+        elif cached is not None:
+            prepared.update(sources=cached['sources'], answer=cached['answer'])
+        else:
+            prepared['sources'] = self._format_sources(relevant_chunks)
+            prepared['cache_key'], prepared['answer'] = self._cached_answer(question, relevant_chunks, use_cache)
+            if prepared['answer'] is not None:
+                self._remember_answer(question, semantic_key, prepared['answer'], prepared['sources'])
+            else:
+                print("正在生成答案...")
+        return prepared
+    
+    def _store_answer(self, question: str, prepared: Dict, answer: str) -> None:
+        """将流式生成的完整答案写入答案缓存与语义答案缓存"""
+        if not answer:
+            return
+        if prepared['cache_key'] is not None:
+            self.answer_cache.put(prepared['cache_key'], question, answer, self.model)
+        self._remember_answer(question, prepared['semantic_key'], answer, prepared['sources'])
+    
+    def _completion_params(self, query: str, context_chunks: List[Dict], stream: bool) -> Dict:
+        """调用大模型的请求参数（同步、流式与异步接口共用）
+        
+        文档片段按 context_order 排列，检索到的文档块相同时提示词逐字节相同，与检索得分的先后无关；
+        流式请求要求在最后一个事件中返回 usage，用于统计提示词缓存命中情况。
+        """
+        params = {
+            'model': self.model,
+            'messages': build_messages(query, context_order(context_chunks)),
+            'temperature': self.temperature,
+            'max_tokens': 1000,
+            'stream': stream,
+        }
+        if stream:
+            params['stream_options'] = {'include_usage': True}
+        return params
+    
+    async def search_async(self, query: str, top_k: int = 10, similarity_threshold: float = 0.01,
+                           scoring: Optional[str] = None, mmr_lambda: Optional[float] = _UNSET,
+                           cutoff: Optional[str] = _UNSET) -> List[ChunkView]:
+        """异步检索：在线程池中执行 search_relevant_chunks，不阻塞事件循环"""
+        return await self._run_in_executor(self.search_relevant_chunks, query, top_k, similarity_threshold, scoring,
+                                           mmr_lambda, cutoff)
+    
+    async def ask_async(self, question: str, top_k: int = 10, similarity_threshold: float = 0.01,
+                        scoring: Optional[str] = None, use_cache: bool = True,
+                        mmr_lambda: Optional[float] = _UNSET, cutoff: Optional[str] = _UNSET) -> Dict:
+        """异步问答接口，返回结构与 ask 相同
+        
+        检索与缓存查询在线程池中执行，大模型请求使用 AsyncOpenAI，同时进行的请求数不超过
+        max_concurrent_requests；一个事件循环即可同时处理大量问题。任务被取消时连接随之关闭。
+        """
+        result = {'question': question, 'answer': '', 'sources': []}
+        async for event in self.ask_stream_async(question, top_k, similarity_threshold, scoring, use_cache,
+                                                 mmr_lambda, cutoff):
+            if event['type'] == 'sources':
+                result['sources'] = event['sources']
+            elif event['type'] == 'done':
+                result['answer'] = event['answer']
+        return result
+    
+    async def ask_stream_async(self, question: str, top_k: int = 10, similarity_threshold: float = 0.01,
+                               scoring: Optional[str] = None, use_cache: bool = True,
+                               mmr_lambda: Optional[float] = _UNSET, cutoff: Optional[str] = _UNSET) -> AsyncIterator[Dict]:
+        """异步流式问答接口，产出的事件与 ask_stream 相同
+        
+        提前停止迭代时请调用 aclose()（或使用 contextlib.aclosing），以便及时关闭与API的连接。
+        """
+        prepared = await self._run_in_executor(self._prepare_answer, question, top_k, similarity_threshold,
+                                               scoring, use_cache, mmr_lambda, cutoff)
+        yield {'type': 'sources', 'question': question, 'sources': prepared['sources']}
+        if prepared['answer'] is not None:
+            yield {'type': 'delta', 'content': prepared['answer']}
+            yield {'type': 'done', 'answer': prepared['answer']}
+            return
+        
+        parts = []
+        try:
+            async with self._llm_limiter():
+                response = await self.async_client.chat.completions.create(
+                    **self._completion_params(question, prepared['chunks'], stream=True)
+                )
+                try:
+                    async for event in response:
+                        self.prompt_cache_stats.record(getattr(event, 'usage', None))
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            parts.append(delta)
+                            yield {'type': 'delta', 'content': delta}
+                finally:
+                    await response.close()
+        except Exception as e:
+            # asyncio.CancelledError 不属于 Exception，取消会直接向上传递
+            error = ("\n\n" if parts else "") + self._answer_error(e)
+            yield {'type': 'delta', 'content': error}
+            yield {'type': 'done', 'answer': "".join(parts) + error}
+            return
+        
+        answer = "".join(parts)
+        await self._run_in_executor(self._store_answer, question, prepared, answer)
+        yield {'type': 'done', 'answer': answer}
+    
+    def _llm_limiter(self) -> asyncio.Semaphore:
+        """限制同时进行的大模型请求数的信号量（每个事件循环一个）"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._llm_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+            self._semaphore_loop = loop
+        return self._llm_semaphore
+    
+    @staticmethod
+    async def _run_in_executor(func: Callable, *args):
+        """在事件循环的默认线程池中执行同步函数（检索与缓存读写）"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+    
+    def _retrieve_for_answer(self, question: str, top_k: int, similarity_threshold: float, scoring: Optional[str],
+                             use_cache: bool, mmr_lambda: Optional[float] = _UNSET, cutoff: Optional[str] = _UNSET) -> Tuple[List[ChunkView], Optional[Dict], Optional[Tuple]]:
+        """检索相关文档块、打包上下文并查找语义答案缓存
+        
+        Returns:
+            (放入提示词的文档片段, 语义缓存命中时的 {'answer', 'sources'}（否则为None）,
+             写入语义缓存所需的 (查询向量, 文档块标识, 问题用字)（未启用语义缓存时为None）)
+        """
+        print(f"\n问题: {question}")
+        print("正在搜索相关内容...")
+        
+        # 搜索相关文档块
+        relevant_chunks = self.search_relevant_chunks(question, top_k=top_k, similarity_threshold=similarity_threshold,
+                                                      scoring=scoring, mmr_lambda=mmr_lambda, cutoff=cutoff)
+        if not relevant_chunks:
+            return relevant_chunks, None, None
+        
+        print(f"找到 {len(relevant_chunks)} 个相关文档片段")
+        # 语义缓存按检索结果（而不是打包后的片段）比较文档块重合度
+        chunk_keys = [(chunk['source'], chunk['chunk_id']) for chunk in relevant_chunks]
+        context_chunks = self._compress_context(question, self._pack_context(relevant_chunks))
+        
+        # 查找语义答案缓存
+        semantic_cache = self.semantic_cache
+        if semantic_cache is None or self.vectorizer is None:
+            return context_chunks, None, None
+        semantic_cache.validate((self.vectors_fingerprint, self.bm25_fingerprint, self.dense_fingerprint))
+        query_vector = self.vectorizer.transform([normalize_query(question)])
+        question_chars = content_chars(normalize_query(question), self.stopwords, self.jieba_hmm)
+        semantic_key = (query_vector, chunk_keys, question_chars)
+        if not use_cache:
+            semantic_cache.record_bypass()
+            return context_chunks, None, semantic_key
+        cached = semantic_cache.lookup(query_vector, chunk_keys, question_chars)
+        if cached is not None:
+            print(f"语义缓存命中（相似问题: {cached['question']}，相似度 {cached['similarity']:.3f}）")
+            cached = {'answer': cached['answer'], 'sources': [dict(source) for source in cached['sources']]}
+        return context_chunks, cached, semantic_key
+    
+    def _pack_context(self, chunks: List[ChunkView]) -> List[Dict]:
+        """用 context_packer 打包检索结果并报告节省的token数，未启用时原样返回"""
+        if self.context_packer is None:
+            return chunks
+        packed, report = self.context_packer.pack(chunks)
+        print(f"上下文打包: {report['chunks']} 个文档块 → {report['segments']} 个片段"
+              f"（合并 {report['merged']}，去重 {report['duplicates']}，超出预算 {report['dropped']}），"
+              f"约 {report['tokens_after']} tokens，节省 {report['tokens_saved']} tokens")
+        return packed
+    
+    def _compress_context(self, question: str, chunks: List[Dict]) -> List[Dict]:
+        """用 context_compressor 抽取与问题相关的句子并报告减少的token数，未启用时原样返回"""
+        if self.context_compressor is None or self.vectorizer is None or not chunks:
+            return chunks
+        query_vector = self.vectorizer.transform([normalize_query(question)])
+        compressed, report = self.context_compressor.compress(query_vector, chunks, self.vectorizer.transform)
+        print(f"上下文压缩: {report['sentences_before']} 句 → {report['sentences_after']} 句，"
+              f"约 {report['tokens_after']} tokens，减少 {report['tokens_saved']} tokens")
+        return compressed
+    
+    def compression_report(self, questions: List[str], compressor: Optional[ContextCompressor] = None,
+                           top_k: int = 10, similarity_threshold: float = 0.01, **search_options) -> Dict[str, float]:
+        """在一组问题上评估抽取式压缩的效果（只检索与压缩，不调用大模型）
+        
+        每个问题按 ask 的流程检索并打包上下文，比较压缩前后的估算token数，以及查询词项在上下文中的保留率
+        （压缩后的上下文仍包含的查询词项数 / 压缩前包含的查询词项数），后者可粗略反映相关信息是否被删去。
+        使用独立的打包器与压缩器，不计入 context_packer 与 context_compressor 的统计。
+        
+        Args:
+            questions: 问题列表（如常用问题或评测集中的问题）
+            compressor: 要评估的压缩器，默认为与 context_compressor 参数相同的压缩器（未启用时为默认参数）
+            top_k: 最大返回文档块数量
+            similarity_threshold: 相似度阈值
+            search_options: 传给 search_relevant_chunks 的其他参数（scoring、mmr_lambda、cutoff）
+        
+        Returns:
+            {'questions': 问题数, 'tokens_before': 压缩前token数之和, 'tokens_after': 压缩后token数之和,
+             'saved_ratio': token减少的比例, 'term_recall': 查询词项保留率的平均值}
+        """
+        if compressor is None:
+            base = self.context_compressor
+            compressor = ContextCompressor() if base is None else ContextCompressor(base.ratio, base.neighbours)
+        packer = None
+        if self.context_packer is not None:
+            packer = ContextPacker(self.context_packer.token_budget, self.context_packer.duplicate_threshold)
+        
+        recalls = []
+        for question in questions:
+            chunks = self.search_relevant_chunks(question, top_k, similarity_threshold, **search_options)
+            if not chunks:
+                continue
+            if packer is not None:
+                chunks = packer.pack(chunks)[0]
+            query_vector = self.vectorizer.transform([normalize_query(question)])
+            compressed = compressor.compress(query_vector, chunks, self.vectorizer.transform)[0]
+            # 压缩前后上下文中出现的查询词项
+            query_terms = set(query_vector.indices)
+            contexts = self.vectorizer.transform(["\n".join(chunk['content'] for chunk in group)
+                                                  for group in (chunks, compressed)])
+            before = query_terms.intersection(contexts[0].indices)
+            after = query_terms.intersection(contexts[1].indices)
+            if before:
+                recalls.append(len(after) / len(before))
+        
+        stats = compressor.stats()
+        return {
+            'questions': stats['requests'],
+            'tokens_before': stats['tokens_before'],
+            'tokens_after': stats['tokens_after'],
+            'saved_ratio': stats['saved_ratio'],
+            'term_recall': float(np.mean(recalls)) if recalls else 1.0,
+        }
+    
+    def _remember_answer(self, question: str, semantic_key: Optional[Tuple], answer: str, sources: List[Dict]) -> None:
+        """将成功生成的答案写入语义答案缓存"""
+        if semantic_key is not None and self.semantic_cache is not None:
+            query_vector, chunk_keys, question_chars = semantic_key
+            self.semantic_cache.add(normalize_query(question), query_vector, chunk_keys, question_chars, answer,
+                                    [dict(source) for source in sources])
+    
+    @staticmethod
+    def _format_sources(chunks: List[Dict]) -> List[Dict]:
+        """整理来源信息：来源文件、相似度与内容预览"""
+        sources = []
+        for chunk in chunks:
+            sources.append({
+                'source': chunk['source'],
+                'similarity': chunk['similarity'],
+                'content_preview': chunk['content'][:100] + '...' if len(chunk['content']) > 100 else chunk['content']
+            })
+        return sources
+    
     def initialize(self) -> None:
         """初始化系统"""
         print("=== 红楼梦RAG问答系统初始化 ===")
-        self.load_documents()
-        if not self.documents:
+        # 根据语料清单计算指纹；索引缓存有效时不再读取文档内容
+        self.compute_fingerprints()
+        self.preprocess_documents()
+        if not self.document_count:
             raise ValueError("未找到任何文档，请检查docs目录")
         
-        self.preprocess_documents()
         self.build_vector_index()
+        if self.scoring == "bm25":
+            self.build_bm25_index()
+        elif self.scoring == "dense":
+            self.build_dense_index()
+        elif self.scoring == "hybrid":
+            self._prepare_retrievers(self.hybrid_retrievers)
         print("系统初始化完成！\n")
+    
+    def prune_cache(self, max_stale: Optional[int] = None, min_age: Optional[float] = None) -> List[Path]:
+        """清理不再被当前指纹引用的索引目录（语料或参数变化后留下的旧索引）
+        
+        不会自动执行，需要时手动调用。仍被其他进程打开的目录不会删除。
+        
+        Args:
+            max_stale: 每类索引额外保留的最近使用的旧目录数，默认为 max_stale_stores
+            min_age: 最近使用时间距今不足该秒数的旧目录不删除，默认为 store_min_age
+        
+        Returns:
+            已删除的目录
+        """
+        if self.chunks_fingerprint is None:
+            self.compute_fingerprints()
+        removed = prune_stores(self.cache_dir, {
+            'chunks': self.chunks_fingerprint,
+            'counts': self.counts_fingerprint,
+            'vectors': self.vectors_fingerprint,
+            'bm25': self.bm25_fingerprint,
+            'dense': self.dense_fingerprint,
+        }, self.max_stale_stores if max_stale is None else max_stale,
+            self.store_min_age if min_age is None else min_age)
+        print(f"已删除 {len(removed)} 个过期的索引目录")
+        return removed
 
 def main():
     """主函数"""
@@ -438,15 +1509,19 @@ def main():
             if not question:
                 continue
             
-            # 获取答案
-            result = rag.ask(question)
-            
-            # 显示结果
-            print(f"\n答案: {result['answer']}")
+            # 流式获取答案，边生成边显示
+            sources = []
+            for event in rag.ask_stream(question):
+                if event['type'] == 'sources':
+                    sources = event['sources']
+                    print("\n答案: ", end="", flush=True)
+                elif event['type'] == 'delta':
+                    print(event['content'], end="", flush=True)
+            print()
             
-            if result['sources']:
+            if sources:
                 print("\n相关文档片段:")
-                for i, source in enumerate(result['sources'], 1):
+                for i, source in enumerate(sources, 1):
                     print(f"{i}. 来源: {source['source']} (相似度: {source['similarity']:.3f})")
                     print(f"   内容预览: {source['content_preview']}")
             
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+语义答案缓存
+同一个问题常被换种说法反复提问（如"甄士隐是谁"与"甄士隐是什么人？"），精确匹配的答案缓存无法命中。
+这里保存已回答问题的TF-IDF向量、检索到的文档块与答案：新问题的向量与某个已回答问题足够相似，
+两次检索到的文档块足够重合，且两个问题的非停用词字符完全相同时，直接返回已有的答案与来源，不再调用大模型。
+最后一项检查不可省略：TF-IDF向量不含单字，"贾宝玉爱谁"与"贾宝玉恨谁"的向量相同、检索结果也相同
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Hashable, List, Optional, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def chunk_overlap(a: Sequence[Hashable], b: Sequence[Hashable]) -> float:
+    """两组文档块标识的Jaccard重合度（均为空时为1）"""
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticCache:
+    """按问题相似度、文档块重合度与问题用字命中的答案缓存（内存中，线程安全）
+
+    条目数超过 max_entries 时按写入顺序淘汰；索引指纹变化时整体清空（文档块标识与向量空间都可能改变）。
+    统计项：hits/misses 为命中与未命中次数，bypasses 为单次请求跳过缓存的次数。
+    """
+
+    def __init__(self, max_entries: int = 1000, similarity_threshold: float = 0.85, overlap_threshold: float = 0.6):
+        """
+        Args:
+            max_entries: 最多缓存的问题数
+            similarity_threshold: 问题TF-IDF向量的余弦相似度阈值
+            overlap_threshold: 检索到的文档块的Jaccard重合度阈值
+        """
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.overlap_threshold = overlap_threshold
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def validate(self, fingerprint: Hashable) -> None:
+        """索引指纹与缓存内容对应的指纹不同时清空缓存"""
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._entries.clear()
+                self._matrix = None
+                self._fingerprint = fingerprint
+
+    def lookup(self, query_vector: sp.csr_matrix, chunk_keys: Sequence[Hashable],
+               question_chars: FrozenSet[str]) -> Optional[Dict]:
+        """查找相似的已回答问题
+
+        Args:
+            query_vector: 1×词项的L2归一化TF-IDF查询向量
+            chunk_keys: 本次检索到的文档块标识
+            question_chars: 问题中非停用词（包括单字词）的字符集合（见 tokenizer.content_chars），
+                与已回答问题的不同时不命中
+
+        Returns:
+            命中时返回缓存条目（question、answer、sources），并附加 similarity 与 overlap；未命中时返回None
+        """
+        with self._lock:
+            entry = self._find(query_vector, chunk_keys, question_chars)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def _find(self, query_vector: sp.csr_matrix, chunk_keys: Sequence[Hashable],
+              question_chars: FrozenSet[str]) -> Optional[Dict]:
+        if not self._entries or query_vector.nnz == 0:
+            return None
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = sp.vstack([self._entries[key]['vector'] for key in self._keys], format='csr')
+        similarities = (self._matrix @ query_vector.T).toarray().ravel()
+        candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+        # 从最相似的问题开始检查文档块重合度
+        for i in candidates[np.argsort(-similarities[candidates], kind='stable')]:
+            entry = self._entries[self._keys[i]]
+            if entry['chars'] != question_chars:
+                continue
+            overlap = chunk_overlap(entry['chunk_keys'], chunk_keys)
+            if overlap >= self.overlap_threshold:
+                return {
+                    'question': entry['question'],
+                    'answer': entry['answer'],
+                    'sources': entry['sources'],
+                    'similarity': float(similarities[i]),
+                    'overlap': overlap,
+                }
+        return None
+
+    def add(self, question: str, query_vector: sp.csr_matrix, chunk_keys: Sequence[Hashable],
+            question_chars: FrozenSet[str], answer: str, sources: List[Dict]) -> None:
+        """保存已回答的问题（同一问题再次写入时覆盖），向量为零（没有已知词项）的问题不保存"""
+        if query_vector.nnz == 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(question, None)
+            self._entries[question] = {
+                'question': question,
+                'vector': sp.csr_matrix(query_vector, copy=True),
+                'chunk_keys': list(chunk_keys),
+                'chars': question_chars,
+                'answer': answer,
+                'sources': sources,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计：命中数、未命中数、命中率、跳过次数与当前条目数"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'bypasses': self.bypasses,
+            'size': len(self._entries),
+        }
@@ -8,7 +8,10 @@ import streamlit as st
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from rag_system import RedMansionRAG
+from rag_system import MMR_CANDIDATES, RedMansionRAG
+from diversity import DEFAULT_MMR_LAMBDA
+from compressor import ContextCompressor
+from index_store import find_stores
 
 # 页面配置
 st.set_page_config(
@@ -168,11 +171,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 def check_cache_exists():
-    """检查缓存文件是否存在"""
+    """检查缓存索引是否存在"""
     cache_dir = Path("cache")
-    vectors_cache = cache_dir / "doc_vectors.pkl"
-    chunks_cache = cache_dir / "doc_chunks.pkl"
-    return vectors_cache.exists() and chunks_cache.exists()
+    return bool(find_stores(cache_dir, "chunks")) and bool(find_stores(cache_dir, "vectors"))
 
 def save_api_key_to_env(api_key):
     """保存API密钥到.env文件"""
@@ -417,7 +418,7 @@ def main():
                     st.markdown(f'''
                     <div class="metric-card">
                         <h3>📄</h3>
-                        <p>{len(st.session_state.rag_system.documents)}</p>
+                        <p>{st.session_state.rag_system.document_count}</p>
                         <small>文档数量</small>
                     </div>
                     ''', unsafe_allow_html=True)
@@ -483,6 +484,47 @@ def main():
                 help="只返回相似度高于此值的文档片段，值越高结果越精确"
             )
             
+            # 自适应截断
+            cutoff_labels = {"不截断": None, "得分拐点": "knee", "相对最高分下降": "drop"}
+            cutoff_label = st.selectbox(
+                "✂️ 自适应截断",
+                list(cutoff_labels),
+                help="根据检索得分曲线只保留明显更相关的文档片段（至少2个，至多为最大返回文档数量），可减少提示词长度"
+            )
+            st.session_state.rag_system.cutoff = cutoff_labels[cutoff_label]
+            
+            # 多样性重排
+            diverse = st.checkbox(
+                "🔀 多样性重排（MMR）",
+                value=False,
+                help=f"从{MMR_CANDIDATES}个候选中选出相关且彼此不重复的文档片段，减少书中套语带来的重复内容"
+            )
+            st.session_state.rag_system.mmr_lambda = DEFAULT_MMR_LAMBDA if diverse else None
+            
+            # 抽取式压缩
+            compress = st.checkbox(
+                "📝 抽取式压缩",
+                value=False,
+                help="只保留文档片段中与问题相关的句子及其前后句，约可减少一半的上下文token"
+            )
+            rag = st.session_state.rag_system
+            if not compress:
+                rag.context_compressor = None
+            elif rag.context_compressor is None:
+                rag.context_compressor = ContextCompressor(ratio=0.5)
+            
+            # 上下文token预算
+            context_budget = st.slider(
+                "🧮 上下文token预算",
+                min_value=200,
+                max_value=4000,
+                value=1200,
+                step=100,
+                help="合并相邻片段、去除重复片段后，最多放入提示词的文档片段token数（估算值）"
+            )
+            if st.session_state.rag_system.context_packer is not None:
+                st.session_state.rag_system.context_packer.token_budget = context_budget
+            
             # 保存到session state
             st.session_state.search_top_k = top_k
             st.session_state.search_similarity_threshold = similarity_threshold
@@ -609,25 +651,24 @@ def main():
             # 显示用户消息
             display_chat_message("user", user_input)
             
-            # 显示思考中的状态
-            thinking_placeholder = st.empty()
-            with thinking_placeholder:
-                display_chat_message("assistant", "正在思考中，请稍候...", typing=True)
-            
             # 生成回答
             try:
-                with st.spinner('🔍 正在搜索相关文档... 📚 正在生成回答...'):
-                    # 获取搜索参数
-                    top_k = getattr(st.session_state, 'search_top_k', 10)
-                    similarity_threshold = getattr(st.session_state, 'search_similarity_threshold', 0.01)
-                    result = st.session_state.rag_system.ask(user_input, top_k=top_k, similarity_threshold=similarity_threshold)
+                # 获取搜索参数
+                top_k = getattr(st.session_state, 'search_top_k', 10)
+                similarity_threshold = getattr(st.session_state, 'search_similarity_threshold', 0.01)
+                events = st.session_state.rag_system.ask_stream(user_input, top_k=top_k, similarity_threshold=similarity_threshold)
                 
-                # 清除思考状态
-                thinking_placeholder.empty()
+                # 先完成检索，得到来源信息
+                with st.spinner('🔍 正在搜索相关文档...'):
+                    retrieval = next(events)
+                
+                # 边生成边显示回答
+                st.markdown("**🤖 红楼梦助手:**")
+                answer = st.write_stream(event['content'] for event in events if event['type'] == 'delta')
                 
                 # 处理来源信息
                 processed_sources = []
-                for source in result['sources']:
+                for source in retrieval['sources']:
                     # 确保使用正确的字段名称
                     if 'content_preview' in source:
                         content = source['content_preview']
@@ -645,17 +686,13 @@ def main():
                 # 添加助手回答到历史
                 st.session_state.chat_history.append({
                     "role": "assistant", 
-                    "content": result['answer'],
+                    "content": answer,
                     "sources": processed_sources
                 })
                 
-                # 显示助手回答
-                display_chat_message("assistant", result['answer'], processed_sources)
-                
 
                 
             except Exception as e:
-                thinking_placeholder.empty()
                 # 改进错误处理，确保即使异常对象没有合适的字符串表示也能提供有用的错误信息
                 error_type = type(e).__name__
                 error_details = str(e) if str(e) else "未知错误"
@@ -688,7 +725,7 @@ def main():
         with col1:
             st.metric("💬 对话轮次", len([msg for msg in st.session_state.chat_history if msg['role'] == 'user']))
         with col2:
-            st.metric("📄 文档数量", len(st.session_state.rag_system.documents))
+            st.metric("📄 文档数量", st.session_state.rag_system.document_count)
         with col3:
             st.metric("📝 文档块数", len(st.session_state.rag_system.doc_chunks))
         with col4:
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+词频统计与TF-IDF构建
+保存未经特征筛选的全量词频矩阵及文档频率，TF-IDF向量由其直接计算；
+文档变化时只需重新统计变化部分的词频，无需重新拟合整个向量化器
+"""
+
+from collections import Counter
+from numbers import Integral
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+
+def word_ngrams(tokens: List[str], ngram_range: Tuple[int, int]) -> List[str]:
+    """由分词结果生成N-gram特征，与 TfidfVectorizer 的词级N-gram规则一致（以空格连接）"""
+    min_n, max_n = ngram_range
+    if max_n == 1:
+        return list(tokens) if min_n == 1 else []
+    features = list(tokens) if min_n == 1 else []
+    for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+        for i in range(len(tokens) - n + 1):
+            features.append(" ".join(tokens[i:i + n]))
+    return features
+
+
+def count_terms(texts: Iterable, analyzer: Callable[[object], List[str]],
+                vocabulary: Dict[str, int]) -> sp.csr_matrix:
+    """统计文本的词频
+
+    Args:
+        texts: 文本（或分词结果）序列
+        analyzer: 文本到特征（分词及N-gram）列表的函数
+        vocabulary: 词项到列号的映射，新出现的词项追加到末尾（原地修改）
+
+    Returns:
+        文本×词项的int32词频矩阵，列数为统计后的词表大小
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        for term, count in Counter(analyzer(text)).items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(count)
+        indptr.append(len(indices))
+    counts = sp.csr_matrix(
+        (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(indptr) - 1, len(vocabulary))
+    )
+    counts.sort_indices()
+    return counts
+
+
+def with_columns(counts: sp.csr_matrix, n_terms: int) -> sp.csr_matrix:
+    """将词频矩阵的列数扩展到n_terms（词表只会在末尾追加词项，已有列号不变）"""
+    return sp.csr_matrix((counts.data, counts.indices, counts.indptr), shape=(counts.shape[0], n_terms))
+
+
+def column_sums(counts: sp.csr_matrix, n_terms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """返回各词项的文档频率与总词频"""
+    df = np.bincount(counts.indices, minlength=n_terms).astype(np.int64)
+    tf = np.bincount(counts.indices, weights=counts.data, minlength=n_terms).astype(np.int64)
+    return df, tf
+
+
+def select_features(terms: List[str], df: np.ndarray, tf: np.ndarray, n_docs: int,
+                    max_features: int = None, min_df=1, max_df=1.0) -> np.ndarray:
+    """按与 TfidfVectorizer 相同的规则筛选特征
+
+    先按文档频率过滤过于常见或罕见的词项，再保留总词频最高的max_features个。
+    词频相同的词项按字典序取舍，结果与词表中词项的存储顺序无关。
+
+    Returns:
+        保留词项在词表中的列号，按词项字典序排列（即最终向量的列顺序）
+    """
+    order = np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+    high = max_df if isinstance(max_df, Integral) else max_df * n_docs
+    low = min_df if isinstance(min_df, Integral) else min_df * n_docs
+    mask = (df[order] <= high) & (df[order] >= low)
+    if max_features is not None and mask.sum() > max_features:
+        kept = np.flatnonzero(mask)
+        top = kept[np.argsort(-tf[order][kept], kind='stable')[:max_features]]
+        mask = np.zeros(len(order), dtype=bool)
+        mask[top] = True
+    return order[mask]
+
+
+def smooth_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """平滑IDF，与 TfidfVectorizer 的默认设置一致：idf = ln((1+n)/(1+df)) + 1"""
+    return np.log((1 + n_docs) / (1 + df)) + 1.0
+
+
+def tfidf_rows(counts: sp.csr_matrix, columns: np.ndarray, idf: np.ndarray) -> sp.csr_matrix:
+    """由词频矩阵的若干行计算TF-IDF向量（逐行计算，可分块处理）
+
+    Args:
+        counts: 文档块×词项的词频矩阵（可为全部行中的一段）
+        columns: select_features 选出的列号
+        idf: 选中词项的IDF
+
+    Returns:
+        行L2归一化的float32 CSR矩阵
+    """
+    vectors = counts[:, columns].astype(np.float64).multiply(idf).tocsr()
+    vectors = normalize(vectors, norm='l2', copy=False).astype(np.float32)
+    vectors.sort_indices()
+    return vectors
+
+
+def row_blocks(indptr: np.ndarray, max_nnz: int) -> Iterator[Tuple[int, int]]:
+    """将CSR矩阵的行按非零元数划分为连续的块，每块不超过max_nnz个非零元（单行超出时独占一块）"""
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        end = int(np.searchsorted(indptr, indptr[start] + max_nnz, side='right')) - 1
+        end = min(max(end, start + 1), n_rows)
+        yield start, end
+        start = end
+
+
+def csr_from_arrays(data: np.ndarray, indices: np.ndarray, indptr: np.ndarray, shape: Tuple[int, int]) -> sp.csr_matrix:
+    """由（可为内存映射的）数组构建CSR矩阵而不复制数据
+
+    indices与indptr类型不一致时scipy会把二者整体转换为同一类型，
+    这里在不溢出的前提下只转换较短的indptr，使indices与data保持为内存映射。
+    """
+    if indptr.dtype != indices.dtype and np.can_cast(indices.dtype, indptr.dtype) \
+            and indptr[-1] <= np.iinfo(indices.dtype).max and max(shape) <= np.iinfo(indices.dtype).max:
+        indptr = np.asarray(indptr, dtype=indices.dtype)
+    return sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def csr_rows(counts: sp.csr_matrix, start: int, end: int) -> sp.csr_matrix:
+    """取CSR矩阵的连续若干行（只复制这些行的数据）"""
+    lo, hi = counts.indptr[start], counts.indptr[end]
+    return sp.csr_matrix((np.asarray(counts.data[lo:hi]), np.asarray(counts.indices[lo:hi]),
+                          np.asarray(counts.indptr[start:end + 1]) - lo),
+                         shape=(end - start, counts.shape[1]))
+
+
+class CountsWriter:
+    """流式写入词频矩阵
+
+    逐块追加词频矩阵的行（数据直接写入索引目录，见 index_store.StoreWriter），
+    同时累计各词项的文档频率与总词频，内存中只保留当前块。
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.df = np.zeros(0, dtype=np.int64)
+        self.tf = np.zeros(0, dtype=np.int64)
+        self.n_rows = 0
+        self.nnz = 0
+        writer.append('count_indptr', [0], dtype=np.int64)
+        writer.append('count_data', np.empty(0, dtype=np.int32))
+        writer.append('count_indices', np.empty(0, dtype=np.int32))
+
+    def append(self, counts: sp.csr_matrix, n_terms: int) -> None:
+        """追加若干行，n_terms为当前词表大小（不小于已追加各块的列数）"""
+        if n_terms > len(self.df):
+            self.df = np.pad(self.df, (0, n_terms - len(self.df)))
+            self.tf = np.pad(self.tf, (0, n_terms - len(self.tf)))
+        indptr = np.asarray(counts.indptr, dtype=np.int64)
+        self.writer.append('count_data', counts.data)
+        self.writer.append('count_indices', counts.indices)
+        self.writer.append('count_indptr', indptr[1:] - indptr[0] + self.nnz)
+        block_df, block_tf = column_sums(counts, n_terms)
+        self.df += block_df
+        self.tf += block_tf
+        self.n_rows += counts.shape[0]
+        self.nnz += counts.nnz
+
+    def compact(self, max_nnz: int) -> np.ndarray:
+        """移除文档频率为0的词项（如删除文件后已不再出现的词），原地改写已追加的列号
+
+        Returns:
+            各词项是否保留的布尔数组
+        """
+        alive = self.df > 0
+        if not alive.all():
+            remap = (np.cumsum(alive) - 1).astype(np.int32)
+            indices = self.writer.appended('count_indices')
+            for start in range(0, len(indices), max_nnz):
+                indices[start:start + max_nnz] = remap[indices[start:start + max_nnz]]
+            if isinstance(indices, np.memmap):
+                indices.flush()
+            self.df, self.tf = self.df[alive], self.tf[alive]
+        return alive
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+分词缓存
+jieba分词是构建索引中最耗时的步骤。分词结果以文档块内容哈希为键持久化保存在SQLite中，
+键中同时包含分词配置指纹（停用词、jieba词典、HMM开关），
+重新统计词频、调整N-gram或特征参数、增量更新时，内容未变的文档块无需再次分词
+"""
+
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# 分词结果中词项之间的分隔符（jieba不会产生包含该控制字符的词）
+TOKEN_SEPARATOR = '\x1f'
+# 单条SQL语句中的最大参数个数（低于旧版SQLite的999限制）
+_BATCH = 500
+
+
+def text_digest(text: str) -> bytes:
+    """文本内容的短哈希，作为缓存键"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class TokenCache:
+    """持久化分词缓存
+
+    同一数据库可保存多种分词配置的结果，以配置指纹区分；多个进程可同时读写。
+    hits/misses 记录本实例的命中与未命中文档块数。
+    """
+
+    def __init__(self, db_path: Path, config: str):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            config: 分词配置指纹，配置变化时旧结果不会被读到
+        """
+        self.db_path = Path(db_path)
+        self.config = config
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tokens (
+                    config TEXT NOT NULL,
+                    digest BLOB NOT NULL,
+                    tokens TEXT NOT NULL,
+                    PRIMARY KEY (config, digest)
+                ) WITHOUT ROWID
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _select(self, digests: List[bytes]) -> Dict[bytes, List[str]]:
+        conn = self._connect()
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        for start in range(0, len(unique), _BATCH):
+            batch = unique[start:start + _BATCH]
+            rows = conn.execute(
+                f"SELECT digest, tokens FROM tokens WHERE config = ? AND digest IN ({','.join('?' * len(batch))})",
+                [self.config, *batch]
+            )
+            for digest, tokens in rows:
+                found[digest] = tokens.split(TOKEN_SEPARATOR) if tokens else []
+        return found
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[List[str]]]:
+        """查询缓存的分词结果，未命中的文本对应None"""
+        digests = [text_digest(text) for text in texts]
+        try:
+            found = self._select(digests)
+        except sqlite3.Error as e:
+            print(f"读取分词缓存时出错: {e}")
+            found = {}
+        results = [found.get(digest) for digest in digests]
+        misses = results.count(None)
+        self.hits += len(results) - misses
+        self.misses += misses
+        return results
+
+    def store(self, texts: Iterable[str], token_lists: Iterable[List[str]]) -> None:
+        """写入分词结果（已存在的键保持不变）"""
+        rows = [(self.config, text_digest(text), TOKEN_SEPARATOR.join(tokens))
+                for text, tokens in zip(texts, token_lists)]
+        if not rows:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO tokens (config, digest, tokens) VALUES (?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            print(f"写入分词缓存时出错: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计：命中数、未命中数与命中率"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+中文分词与多进程词频统计
+分词函数为模块级函数，可在进程池中使用；并行构建时每个工作进程对一批文档块分词并统计词频，
+主进程按批次顺序合并词表，结果与串行统计完全一致
+"""
+
+from functools import partial
+from typing import FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import jieba
+import numpy as np
+import scipy.sparse as sp
+
+from term_counts import count_terms, word_ngrams
+
+PUNCTUATION = '，。！？；：""（）【】《》、'
+
+# 工作进程中的分词配置，由 init_worker 设置
+_worker_stopwords: Set[str] = set()
+_worker_hmm = True
+
+
+def filter_tokens(words: Iterable[str], stopwords: Set[str]) -> List[str]:
+    """过滤停用词、标点符号、空白字符和单字"""
+    filtered_words = []
+    for word in words:
+        word = word.strip()
+        if (word and
+                len(word) > 1 and  # 过滤单字符（除了一些有意义的单字）
+                word not in stopwords and
+                not word.isspace() and
+                not all(char in PUNCTUATION for char in word)):
+            filtered_words.append(word)
+    return filtered_words
+
+
+def tokenize(text: str, stopwords: Set[str], hmm: bool = True) -> List[str]:
+    """jieba分词并过滤"""
+    return filter_tokens(jieba.cut(text, HMM=hmm), stopwords)
+
+
+def content_chars(text: str, stopwords: Set[str], hmm: bool = True) -> FrozenSet[str]:
+    """文本中非停用词（包括单字词）的字符集合
+
+    检索用的分词会过滤单字，"贾宝玉爱谁"与"贾宝玉恨谁"的词项完全相同；
+    比较两个问题是否只是说法不同时，需要保留"爱"、"恨"这样的单字。
+    """
+    chars = set()
+    for word in jieba.cut(text, HMM=hmm):
+        word = word.strip()
+        if word and word not in stopwords and not all(char in PUNCTUATION for char in word):
+            chars.update(word)
+    return frozenset(chars)
+
+
+def init_worker(stopwords: Set[str], hmm: bool, dictionary: Optional[str]) -> None:
+    """进程池初始化函数：设置分词配置并加载jieba词典
+
+    以fork方式启动的进程直接继承主进程已加载的词典（包括 jieba.add_word 添加的词）；
+    以spawn方式启动时只能重新加载词典文件，运行时添加的词需写入自定义词典文件。
+    """
+    global _worker_stopwords, _worker_hmm
+    _worker_stopwords = stopwords
+    _worker_hmm = hmm
+    if dictionary and jieba.dt.dictionary != dictionary:
+        jieba.set_dictionary(dictionary)
+    jieba.initialize()
+
+
+def count_shard(items: Sequence[Union[str, List[str]]], ngram_range: Tuple[int, int]):
+    """在工作进程中统计一批文档块的词频
+
+    Args:
+        items: 文档块文本，或已缓存的分词结果（词列表）
+        ngram_range: N-gram范围
+
+    Returns:
+        (本批新分词的结果 {下标: 词列表}, 本批词表（按首次出现顺序）, 使用本批词表列号的词频矩阵)
+    """
+    tokenized = {}
+    token_lists = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = tokenized[i] = tokenize(item, _worker_stopwords, _worker_hmm)
+        token_lists.append(item)
+    vocabulary = {}
+    counts = count_terms(token_lists, partial(word_ngrams, ngram_range=ngram_range), vocabulary)
+    return tokenized, list(vocabulary), counts
+
+
+def merge_shard(counts: sp.csr_matrix, terms: List[str], vocabulary: dict) -> sp.csr_matrix:
+    """将批内词频矩阵的列号映射到全局词表（新词项按批内首次出现顺序追加，原地修改vocabulary）"""
+    columns = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in terms], dtype=np.int32)
+    merged = sp.csr_matrix((counts.data, columns[counts.indices], counts.indptr),
+                           shape=(counts.shape[0], len(vocabulary)))
+    merged.sort_indices()
+    return merged